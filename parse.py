@@ -1,19 +1,39 @@
 #!/usr/bin/env python3
 #
-# Usage: parse.py 
+# Usage: parse.py [--force] [--sort ORDER] [--alt-sort ORDER ...] 
+#                 [--page-size N | --decade-pages] [--check-covers]
 # Generates 'index.html' and 'README.md' from songs listed in 'list_of_songs'
-# and data stored in 'data/wiki_data.txt'. 
+# and data stored in 'data/wiki_data.txt'. Build stages only run when their
+# input files changed since the last build, unless '--force' is specified.
+# ORDER is a comma separated list of columns: date, bpm, key, length, artist
+# and origin. Column prefixed with '-' is sorted in descending order, e.g.
+# '--sort=-bpm,date'. Each '--alt-sort' generates additional 
+# 'index_by_<ORDER>.html' page. Options '--page-size' and '--decade-pages' 
+# split 'index.html' into pages 'index.html', 'index_<PAGE>.html', ... 
+# Pages that earlier builds generated and that are no longer generated get 
+# removed.
+# Analytics of connections between songs are saved into 
+# 'data/connections.json'.
+# Option '--check-covers' lists songs without cover and covers that are not 
+# used by any song, instead of building.
 #
 # To install Image library run:
 #   pip3 install pillow
 
+import argparse
 import calendar
+import collections
+import concurrent.futures
+import contextlib
+import filecmp
+import functools
+import hashlib
 import json
 import math
 import os
 import re
+import string
 import sys
-import matplotlib.pyplot as plt
 import urllib.parse
 
 
@@ -37,27 +57,27 @@ NO_KARAOKE = ['The Ecstasy of Gold', 'If 6 Was 9', '21st Century Schizoid Man',
 JSONIZE_WIKI_DATA = True
 SORT_BY_DATE = True
 ADD_PLOTS = True
+ADD_THUMBNAILS = True
+ADD_CONNECTIONS = True
 
 TEMPLATE = 'web/template.html'
 LIST_OF_SONGS = 'list_of_songs.txt'
+WIKI_DATA = 'data/wiki_data.txt'
 JSON_DATA = 'data/wiki_data.json'
+JSON_CACHE = 'data/wiki_data_cache.json'
+PLOT_CACHE = 'data/plot_cache.json'
+CONNECTIONS = 'data/connections.json'
+BUILD_MANIFEST = 'data/build.json'
+WRITE_BUFFER = 2**16
+IMG_DIR = 'data/img'
+COVER_DIR = 'data/img/cover'
+THUMB_DIR = 'data/img/thumb'
+THUMB_INDEX = 'data/img/thumb/index.json'
+PLOT_FILES = ['years', 'months', 'minutes', 'bpm', 'key', 'origin']
+# Format of plots, 'png' or 'svg'.
+PLOT_FORMAT = 'png'
 
 DISPLAY_KEYS = ['genre', 'writer', 'producer', 'length', 'label']
-MONTHS_RE = 'january|february|march|april|may|june|july|august|september|' \
-            'october|november|december'
-
-MONTHS = {'january': 1,
-          'february': 2,
-          'march': 3,
-          'april': 4,
-          'may' : 5,
-          'june': 6,
-          'july': 7,
-          'august': 8,
-          'september': 9,
-          'october': 10,
-          'november': 11,
-          'december': 12}
 
 HEIGHT_FACTOR = 24.333
 IMG_HEIGHT = int(HEIGHT_FACTOR*len(DISPLAY_KEYS)) # 123
@@ -70,19 +90,182 @@ KARAOKE_REPLACEMENTS = ((' ', '-'), ('.', '-'), ('--', '-'))
 ##  MAIN
 #
 
+Stage = collections.namedtuple('Stage', 'name inputs outputs run options', 
+                               defaults=[()])
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Generates song list pages.')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='run all stages regardless of their inputs')
+    parser.add_argument('--sort', type=parse_order, metavar='ORDER',
+                        default=parse_order('date' if SORT_BY_DATE else ''),
+                        help='order of songs, e.g. "date" or "-bpm,artist"')
+    parser.add_argument('--alt-sort', type=parse_order, metavar='ORDER', 
+                        action='append', default=[],
+                        help='also generate page with songs in this order')
+    pages = parser.add_mutually_exclusive_group()
+    pages.add_argument('--page-size', type=int, metavar='N',
+                       help='split songs into pages of N songs')
+    pages.add_argument('--decade-pages', action='store_true',
+                       help='split songs into pages by decade of release')
+    parser.add_argument('--check-covers', action='store_true',
+                        help='list missing and unused covers and exit')
+    args = parser.parse_args()
+    if args.check_covers:
+        check_covers()
+        return
+    state = {'order': args.sort, 'altOrders': args.alt_sort, 
+             'pageSize': args.page_size, 'decadePages': args.decade_pages}
+    build(get_stages(state), args.force, state)
+
+
+def get_stages(state):
+    """Returns stages in the order they need to run. Stage's 'run' function
+    receives a dict that is shared between stages and can return a list of 
+    additional outputs, that are only known after it ran. Additional outputs 
+    of the previous run that are not returned again get removed."""
+    out = []
     if JSONIZE_WIKI_DATA:
-        os.popen('cd scripts; ./jsonize.py; cd ..').read()
-    readme = get_file_contents(LIST_OF_SONGS)
-    albumData = read_json(JSON_DATA)
-    listOfAlbums = get_list_of_songs(readme)
-    if SORT_BY_DATE:
-        listOfAlbums = sort_by_date(listOfAlbums, albumData)
+        out.append(Stage('jsonize', [WIKI_DATA, 'scripts/jsonize.py'], 
+                         [JSON_DATA], run_jsonize))
     if ADD_PLOTS:
-        os.popen('cd scripts; ./plot.py; cd ..').read()
-    out_html, out_md = generate_files(albumData, listOfAlbums)
-    write_to_file('index.html', out_html)
-    write_to_file('README.md', out_md)
+        out.append(Stage('plots', [JSON_DATA, LIST_OF_SONGS, 'scripts/plot.py'],
+                         [f'{IMG_DIR}/{a}.{PLOT_FORMAT}' for a in PLOT_FILES], 
+                         run_plots, [PLOT_FORMAT]))
+    if ADD_THUMBNAILS:
+        out.append(Stage('thumbnails', [COVER_DIR, 'scripts/thumbnails.py'],
+                         [THUMB_INDEX], run_thumbnails, [IMG_HEIGHT]))
+    if ADD_CONNECTIONS:
+        out.append(Stage('connections', [JSON_DATA, 
+                                         'scripts/find_connections.py'],
+                         [CONNECTIONS], run_connections))
+    alt_pages = [get_alt_page_name(a) for a in state['altOrders']]
+    out.append(Stage('pages', [JSON_DATA, LIST_OF_SONGS, TEMPLATE, 'parse.py',
+                               COVER_DIR, THUMB_INDEX], 
+                     ['index.html', 'README.md'] + alt_pages, run_pages,
+                     [state['order'], state['altOrders'], state['pageSize'],
+                      state['decadePages']]))
+    return out
+
+
+def build(stages, force=False, state=None):
+    manifest = read_json(BUILD_MANIFEST) if os.path.isfile(BUILD_MANIFEST) \
+                   else {}
+    state = {} if state is None else state
+    for stage in stages:
+        fingerprint = get_fingerprint(stage.inputs, stage.options)
+        entry = manifest.get(stage.name)
+        if not force and isinstance(entry, dict) and \
+                entry['fingerprint'] == fingerprint and \
+                all(os.path.exists(a) for a in stage.outputs + entry['outputs']):
+            continue
+        outputs = stage.run(state) or []
+        if isinstance(entry, dict):
+            remove_stale_outputs(entry['outputs'], stage.outputs + outputs)
+        manifest[stage.name] = {'fingerprint': fingerprint, 'outputs': outputs}
+        write_to_file(BUILD_MANIFEST, json.dumps(manifest, indent=2))
+
+
+def remove_stale_outputs(old_outputs, outputs):
+    for path in old_outputs:
+        if path not in outputs and os.path.isfile(path):
+            os.remove(path)
+
+
+# Scripts are imported by stages that use them, so that no-op builds don't pay 
+# for their imports.
+
+def run_jsonize(state):
+    from scripts import jsonize
+    state['albumData'] = jsonize.jsonize(WIKI_DATA, JSON_DATA, 
+                                         cache_file=JSON_CACHE)
+
+
+def run_plots(state):
+    from scripts import plot
+    albumData = get_album_data(state)
+    songNames = [get_song_name(a) for a in get_albums(state)]
+    plot.plot(albumData, songNames, IMG_DIR, jobs=os.cpu_count(), 
+              cache_file=PLOT_CACHE, img_format=PLOT_FORMAT)
+
+
+def run_thumbnails(state):
+    from scripts import thumbnails
+    thumbnails.thumbnails(COVER_DIR, THUMB_DIR, IMG_HEIGHT, os.cpu_count())
+
+
+def run_connections(state):
+    from scripts import find_connections
+    find_connections.analyze(get_album_data(state), CONNECTIONS)
+
+
+def run_pages(state):
+    albumData = get_album_data(state)
+    missing = get_songs_without_cover(get_albums(state), albumData)
+    if missing:
+        for albumName in missing:
+            print(f'Missing cover image for album "{albumName}".', 
+                  file=sys.stderr)
+        sys.exit(1)
+    listOfAlbums = get_sorted_albums(state)
+    pageNames = []
+    if state['pageSize'] or state['decadePages']:
+        pages = get_pages(listOfAlbums, albumData, state['pageSize'])
+        write_files(albumData, listOfAlbums, None, 'README.md')
+        write_pages(albumData, pages, len(listOfAlbums))
+        pageNames = [a.fileName for a in pages[1:]]
+    else:
+        write_files(albumData, listOfAlbums, 'index.html', 'README.md')
+    for order in state['altOrders']:
+        write_files(albumData, get_sorted_albums(state, order), 
+                    get_alt_page_name(order))
+    return pageNames + [get_alt_page_name(a) for a in state['altOrders']]
+
+
+def get_alt_page_name(order):
+    name = ','.join(f"{'-' if desc else ''}{column}" for column, desc in order)
+    return f'index_by_{name}.html'
+
+
+def get_album_data(state):
+    if 'albumData' not in state:
+        state['albumData'] = read_json(JSON_DATA)
+    return state['albumData']
+
+
+def get_albums(state):
+    if 'listOfAlbums' not in state:
+        readme = get_file_contents(LIST_OF_SONGS)
+        state['listOfAlbums'] = get_list_of_songs(readme)
+    return state['listOfAlbums']
+
+
+def get_sorted_albums(state, order=None):
+    """Sorts by 'order' or by the '--sort' order if it is None. Sort columns 
+    are computed once and shared between orders."""
+    listOfAlbums = get_albums(state)
+    columns = state.setdefault('sortColumns', {})
+    for column, _ in order or state['order']:
+        if column not in columns:
+            columns[column] = get_sort_column(column, listOfAlbums, 
+                                              get_album_data(state))
+    return sort_albums(listOfAlbums, columns, order or state['order'])
+
+
+def get_fingerprint(paths, options=()):
+    """Hashes contents of files and names, sizes and modification times of
+    files in directories, together with the options."""
+    out = hashlib.sha1(repr(options).encode())
+    for path in paths:
+        out.update(path.encode())
+        if os.path.isdir(path):
+            for a_file in sorted(get_dir_index(path).values()):
+                out.update(f'{a_file.name}{a_file.size}{a_file.mtime}'.encode())
+        elif os.path.isfile(path):
+            with open(path, 'rb') as f:
+                out.update(f.read())
+    return out.hexdigest()
 
 
 def get_list_of_songs(readme):
@@ -94,16 +277,38 @@ def get_list_of_songs(readme):
     return listOfSongs
 
 
-def sort_by_date(listOfAlbums, albumData):
-    dates = [(get_numeric_date(get_song_name(a), albumData), a) for a in 
-             listOfAlbums]
-    dates.sort()
-    return [a[1] for a in dates]
-
-
-def generate_files(albumData, listOfAlbums):
-    table_html, table_md = generate_list(listOfAlbums, albumData)
-    if ADD_PLOTS:
+def write_files(albumData, listOfAlbums, htmlFile, mdFile=None, no_albums=None,
+                nav='', add_plots=ADD_PLOTS):
+    """Writes html and Markdown file, each of them optional, in a single pass
+    through the songs, so that only one song's fragments are held in memory. 
+    Navigation is written before and after the songs of html file."""
+    no_albums = no_albums or len(listOfAlbums)
+    title = f"{no_albums} Greatest Songs of All Time"
+    template = get_template(TEMPLATE)
+    with open_atomic(htmlFile) as out_html, open_atomic(mdFile) as out_md:
+        if out_md:
+            out_md.write(get_md_head(title, template))
+        for text, field in template.segments:
+            if out_html:
+                out_html.write(text)
+            if field == 'table':
+                write_table(albumData, listOfAlbums, out_html, out_md, nav, 
+                            add_plots)
+            elif field and out_html:
+                out_html.write({'title': title}[field])
+
+
+def write_table(albumData, listOfAlbums, out_html, out_md, nav, add_plots):
+    if out_html:
+        out_html.write(nav)
+    for song_html, song_md in generate_list(listOfAlbums, albumData):
+        if out_html:
+            out_html.write(song_html)
+        if out_md:
+            out_md.write(song_md)
+    if out_html:
+        out_html.write(nav)
+    if add_plots:
         # names = [('Origin', 'origin'), 
         #          ('Release Date — Year', 'years'),
         #          ('Release Date — Month', 'months'),
@@ -114,14 +319,68 @@ def generate_files(albumData, listOfAlbums):
                  ('Key', 'key'),
                  ('Tempo', 'bpm')]
         plots_html, plots_md = get_plots(names)
-        table_html += f'<br><br><br><br><hr>{plots_html}'
-        table_md += plots_md
-    no_albums = len(listOfAlbums)
-    title = f"{no_albums} Greatest Songs of All Time"
-    template = ''.join(get_file_contents(TEMPLATE))
-    out_html = template.format(title=title, table=table_html)
-    out_md = get_out_md(table_md, title, template)
-    return out_html, out_md
+        if out_html:
+            out_html.write(f'<br><br><br><br><hr>{plots_html}')
+        if out_md:
+            out_md.write(plots_md)
+
+
+###
+##  PAGES
+#
+
+Page = collections.namedtuple('Page', 'fileName label albums')
+
+# Album data of the process that renders pages.
+WORKER_STATE = {}
+
+
+def get_pages(listOfAlbums, albumData, pageSize=None):
+    """Splits albums into pages of 'pageSize' albums or by decade of release if
+    'pageSize' is None. Order of albums is preserved within pages."""
+    if pageSize:
+        groups = [(str(i//pageSize + 1), listOfAlbums[i:i+pageSize]) 
+                      for i in range(0, len(listOfAlbums), pageSize)]
+    else:
+        decades = collections.defaultdict(list)
+        for albumName in listOfAlbums:
+            songData = albumData.get(get_song_name(albumName), {})
+            year = songData.get('released_year')
+            decades[year//10*10 if year else None].append(albumName)
+        groups = [(f'{a}s' if a else 'unknown', decades[a]) for a in 
+                      sorted(decades, key=lambda a: (a is None, a))]
+    # Empty list still gets the first page.
+    groups = groups or [('1', [])]
+    return [Page('index.html' if i == 0 else f'index_{label}.html', label, 
+                 albums) for i, (label, albums) in enumerate(groups)]
+
+
+def write_pages(albumData, pages, no_albums):
+    """Renders pages in parallel. Album data is sent to each process only once.
+    Plots are added to the last page."""
+    tasks = [(page, get_nav(pages, page), page is pages[-1] and ADD_PLOTS, 
+              no_albums) for page in pages]
+    jobs = min(len(pages), os.cpu_count())
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=init_page_worker, 
+            initargs=(albumData,)) as executor:
+        list(executor.map(write_page, tasks))
+
+
+def init_page_worker(albumData):
+    WORKER_STATE['albumData'] = albumData
+
+
+def write_page(task):
+    page, nav, add_plots, no_albums = task
+    write_files(WORKER_STATE['albumData'], page.albums, page.fileName, 
+                no_albums=no_albums, nav=nav, add_plots=add_plots)
+
+
+def get_nav(pages, current):
+    links = [f'<b>{a.label}</b>' if a is current else 
+                 f'<a href="{a.fileName}">{a.label}</a>' for a in pages]
+    return f'<p><b>Pages:</b> {" | ".join(links)}</p>\n'
 
 
 def get_plots(names):
@@ -133,17 +392,17 @@ def get_plots(names):
     return ''.join(out_html), ''.join(out_md)
 
 
-def get_plot(name, filename):
+def get_plot(name, filename, img_format=PLOT_FORMAT):
     a_id = re.sub('\s', '-', filename.strip().lower())
+    src = f'data/img/{filename}.{img_format}'
     plot_html = f'<h2><a href="#{a_id}" name="{a_id}">#</a>{name}</h2>\n' \
-                f'<img src="data/img/{filename}.png" alt="{name}" width="920"' \
-                f'/>\n'
-    plot_md = f'\n{name}\n------\n![{name}](data/img/{filename}.png)'
+                f'<img src="{src}" alt="{name}" width="920"/>\n'
+    plot_md = f'\n{name}\n------\n![{name}]({src})'
     return plot_html, plot_md
 
 
 def generate_list(listOfAlbums, albumData):
-    out_html, out_md = [], []
+    """Yields html and Markdown fragments of each song."""
     for albumName in listOfAlbums:
         songName = get_song_name(albumName)
         if not songName:
@@ -157,12 +416,8 @@ def generate_list(listOfAlbums, albumData):
                                          albumData)
         image_html, image_md = get_image(songName, bandName, albumData)
         div_html, div_md = get_div(songName, albumData)
-        out_html.extend((title_html, image_html, div_html))
-        if not image_md:
-            print(f'Missing cover image for album "{albumName}".', file=sys.stderr)
-            sys.exit(1)
-        out_md.extend((title_md, image_md, div_md))
-    return ''.join(out_html), ''.join(out_md)
+        yield f'{title_html}{image_html}{div_html}', \
+              f'{title_md}{image_md}{div_md}'
 
 
 def get_song_name(albumName):
@@ -173,32 +428,113 @@ def get_song_name(albumName):
     return song.group(1)
 
 
-def get_out_md(table_md, title, template):
+def get_md_head(title, template):
     out = [title, '\n']
     out.append('=' * len(title))
     out.append('\n')
-    match = re.search('\{title\}</h1>(.*)\{table\}', template, flags=re.DOTALL)
-    out.append(match.group(1))
-    out.append(table_md)
+    out.append(template.md_intro)
     return ''.join(out)
 
 
+###
+##  TEMPLATE
+#
+
+Template = collections.namedtuple('Template', 'segments md_intro')
+
+
+@functools.lru_cache()
+def get_template(fileName):
+    """Splits template into (static text, field name) segments, so that it can 
+    be streamed without formatting, and extracts the intro for Markdown file, 
+    that is everything between the title and the table."""
+    template = ''.join(get_file_contents(fileName))
+    segments = [(text, field) for text, field, _, _ in 
+                    string.Formatter().parse(template)]
+    match = re.search('\{title\}</h1>(.*)\{table\}', template, flags=re.DOTALL)
+    return Template(segments, match.group(1))
+
+
+###
+##  SORT
+#
+
+def parse_order(order):
+    """Returns list of (column, descending) tuples."""
+    out = []
+    for column in filter(None, order.split(',')):
+        descending = column.startswith('-')
+        column = column.lstrip('-').strip().lower()
+        if column not in SORT_COLUMNS:
+            raise argparse.ArgumentTypeError(f'Unknown sort column: {column}')
+        out.append((column, descending))
+    return out
+
+
+def get_sort_column(column, listOfAlbums, albumData):
+    """Returns column's values for every album. Value is None if song has no
+    data for that column."""
+    parser = SORT_COLUMNS[column]
+    out = []
+    for albumName in listOfAlbums:
+        songData = albumData.get(get_song_name(albumName), {})
+        value = songData.get(SORT_KEYS.get(column, column))
+        if isinstance(value, list):
+            value = value[0] if value else None
+        out.append(None if value is None else parser(value))
+    return out
+
+
+def sort_albums(listOfAlbums, columns, order):
+    """Stable sort that sorts by the last column first. Songs with missing 
+    values come last in both directions."""
+    indices = list(range(len(listOfAlbums)))
+    for column, descending in reversed(order):
+        values = columns[column]
+        if descending:
+            indices.sort(key=lambda i: (values[i] is not None, values[i]), 
+                         reverse=True)
+        else:
+            indices.sort(key=lambda i: (values[i] is None, values[i]))
+    return [listOfAlbums[i] for i in indices]
+
+
+def get_int(value):
+    match = re.match('\d+', str(value).strip())
+    if match:
+        return int(match.group())
+
+
+def get_lower(value):
+    return value.strip().lower()
+
+
+SORT_COLUMNS = {'date': int,
+                'bpm': get_int,
+                'key': int,
+                'length': int,
+                'artist': get_lower,
+                'origin': get_lower}
+
+# Columns that are read from values normalized by jsonize.
+SORT_KEYS = {'date': 'released_sort', 'key': 'key_index', 
+             'length': 'length_seconds'}
+
+
 ###
 ##  TITLE
 #
 
 def get_title(albumName, songName, bandName, albumData):
     album_name_abr = albumName.replace(' ', '')
-    releaseDate = albumData[songName]['released']
-    if type(releaseDate) == list:
-        releaseDate = releaseDate[0]
-    year = get_numeric_year(releaseDate)
+    year = albumData[songName]['released_year']
     if not year:
+        releaseDate = albumData[songName]['released']
         print(f'Cannot match release year with releaseDate: {releaseDate}')
         year = ''
-    year = year[-2:]
-    month = get_month(releaseDate)
-    month = '' if not month else calendar.month_abbr[int(month)]
+    year = str(year)[-2:]
+    month = albumData[songName]['released_month']
+    month = '' if not month else calendar.month_abbr[month]
     link = f"<a href='#{album_name_abr}' name='{album_name_abr}'>#</a>" 
     text = f"'{year} {month} | \"{songName}\" — {bandName}"
     genius = get_genius_link(bandName, songName, albumData)
@@ -264,22 +600,24 @@ def get_karaoke_link(bandName, songName, albumData):
 ##  IMAGE
 #
 
+IMAGE_DIV_START = '<div style="display:inline-block;vertical-align:top;border' \
+                  '-left:7px solid transparent">\n'
+
+
 def get_image(songName, bandName, albumData):
     cover_html, cover_md = get_cover(songName, bandName, albumData)
     if not cover_html:
         cover_html = ''
-    image_html = f'<div style="display:inline-block;vertical-align:top;border' \
-                 f'-left:7px solid transparent">\n{cover_html}\n</div>'
+    image_html = f'{IMAGE_DIV_START}{cover_html}\n</div>'
     return image_html, cover_md
 
 
 def get_cover(albumName, bandName, albumData):
     imageLink = get_img_link(albumName, albumData)
-    if not imageLink or not os.path.isfile(imageLink):
+    if not imageLink or not has_cover(albumName, albumData):
         return None, None
     yt_link = get_yt_link(f'{bandName} {albumName}')
-    cover_html = f'{yt_link}<img src="{imageLink}" alt="cover" height="' \
-                 f'{IMG_HEIGHT}px"/></a>\n'
+    cover_html = f'{yt_link}{get_cover_img(albumName, albumData)}</a>\n'
     cover_md = f'{yt_link}<img src="{imageLink}" align="left" alt="cover" hei' \
                f'ght="{IMG_HEIGHT}px"/></a>\n'
     return cover_html, cover_md
@@ -295,6 +633,66 @@ def get_img_link(albumName, albumData):
     return f'data/img/cover/{link}'
 
 
+def get_cover_img(albumName, albumData):
+    """Returns picture element with WebP and JPEG thumbnails or the img element 
+    with original cover if thumbnails are missing."""
+    link = albumData[albumName]['cover']
+    thumbnail = get_thumbnail_index().get(link) if ADD_THUMBNAILS else None
+    if not thumbnail or not thumbnail['heights']:
+        return f'<img src="{COVER_DIR}/{link}" alt="cover" height="' \
+               f'{IMG_HEIGHT}px"/>'
+    webp = get_srcset(thumbnail, 'webp')
+    jpg = get_srcset(thumbnail, 'jpg')
+    src = get_thumbnail_link(thumbnail, thumbnail['heights'][0], 'jpg')
+    return f'<picture><source type="image/webp" srcset="{webp}"><img src="' \
+           f'{src}" srcset="{jpg}" alt="cover" height="{IMG_HEIGHT}px"/>' \
+           f'</picture>'
+
+
+def get_srcset(thumbnail, ext):
+    out = []
+    for height in thumbnail['heights']:
+        scale = f'{height/IMG_HEIGHT:.3g}'
+        out.append(f'{get_thumbnail_link(thumbnail, height, ext)} {scale}x')
+    return ', '.join(out)
+
+
+def get_thumbnail_link(thumbnail, height, ext):
+    return f"{THUMB_DIR}/{thumbnail['hash']}_{height}.{ext}"
+
+
+@functools.lru_cache()
+def get_thumbnail_index():
+    if not os.path.isfile(THUMB_INDEX):
+        return {}
+    return read_json(THUMB_INDEX)
+
+
+def has_cover(albumName, albumData):
+    link = albumData.get(albumName, {}).get('cover')
+    return bool(link) and link in get_dir_index(COVER_DIR)
+
+
+def get_songs_without_cover(listOfAlbums, albumData):
+    out = []
+    for albumName in listOfAlbums:
+        songName = get_song_name(albumName)
+        if songName in albumData and not has_cover(songName, albumData):
+            out.append(albumName)
+    return out
+
+
+def check_covers():
+    albumData = read_json(JSON_DATA)
+    listOfAlbums = get_list_of_songs(get_file_contents(LIST_OF_SONGS))
+    for albumName in get_songs_without_cover(listOfAlbums, albumData):
+        print(f'Missing cover: {albumName}')
+    used = {a.get('cover') for a in albumData.values()}
+    for cover in sorted(get_dir_index(COVER_DIR).values()):
+        if cover.name not in used:
+            print(f'Unused cover: {cover.name} ({cover.size} bytes)')
+
+
 def get_yt_link(albumName):
     for title, mod in YT_MOD.items():
         if title in albumName:
@@ -317,6 +715,14 @@ def get_hd_filter(albumName):
 ##  DIV
 #
 
+DIV_START = '<div style="display:inline-block;border-left:15px solid transpar' \
+            'ent"><table>'
+
+# Row labels for single and multiple values of display keys.
+ROW_LABELS = {(key, is_list): (f'{key}s' if is_list else key).title() 
+                  for key in DISPLAY_KEYS for is_list in (False, True)}
+
+
 def get_div(songName, albumData):
     data_html, data_md = [], []
     for key in DISPLAY_KEYS:
@@ -325,8 +731,7 @@ def get_div(songName, albumData):
         if row_md:
             data_md.append(row_md)
     data_str = '\n'.join(data_html)
-    div_html = f'<div style="display:inline-block;border-left:15px solid tran' \
-               f'sparent"><table>{data_str}</table></div>'
+    div_html = f'{DIV_START}{data_str}</table></div>'
     div_md = get_div_md(data_md)
     return div_html, div_md
 
@@ -342,157 +747,19 @@ def get_row(songData, key):
     if key not in songData:
         return '', ''
     value = songData[key]
-    if type(value) == list:
+    is_list = type(value) == list
+    if is_list:
         value = ', '.join(value)
-        key = f'{key}s'
     if type(value) != str:
         return '', ''
-    key = key.title()
-    if key not in ['Length', 'Lengths']:
+    if key != 'length':
         value = value.title()
+    key = ROW_LABELS[(key, is_list)]
     row_html = f"<tr><td><b>{key}&ensp;</b></td><td><b>{value}</b></td></tr>"
     row_md = f"{key}:&ensp;{value}"
     return row_html, row_md
 
 
-###
-##  DATE
-#
-
-def get_numeric_date(album, albumData):
-    released = albumData[album]['released']
-    if type(released) == list:
-        released = released[0]
-    released = released.strip()
-    released = get_first_date(released)
-    out = None
-    if re.match('\d{4}\.\d+', released):
-        out = parse_date_with_commas(released)
-    elif ',' in released:
-        out = parse_date_with_comma(released)
-    else:
-        out = parse_date(released)
-    return out
-
-
-def get_first_date(released):
-    """
-    1956.01.27
-    1967.1.1
-    1969.03
-    
-    September 25, 1967
-    April, 1962
-
-    30 June 1997
-    8. february 1980
-    March 1974
-    1974
-    """
-    FORMATS = ['\d{4}\.\d+\.\d+', '\d{4}\.\d+',
-               '\w+ \d+, \d{4}', '\w+, \d{4}',
-               '\d+ \w+ \d{4}', '\d+\. \w+ \d{4}', '\w+ \d{4}', '\d{4}']
-
-    for form in FORMATS:
-        if re.match(form, released):
-            return re.match(form, released).group()
-
-
-def parse_date_with_commas(released):
-    """
-    1969.03
-    1956.01.27
-    1967.1.1
-    """
-    out = ['', '06', '15']
-    tokens = released.split('.')
-    for i, token in enumerate(tokens):
-        out[i] = token if token.isnumeric() else out[i]
-        if len(out[i]) == 1:
-            out[i] = '0' + out[i]
-    return int(out[0] + out[1] + out[2])
-
-
-def parse_date_with_comma(released):
-    """
-    September 25, 1967
-    April, 1962
-    January 4, 1967
-    """
-    tokens = [a.strip() for a in released.split(',')]
-    year = tokens[1]
-    month = tokens[0]
-    day = '15'
-    if ' ' in month:
-        tokens = month.split()
-        month = tokens[0]
-        day = tokens[1]
-    month = get_month_from_word(month)
-    day = get_day_from_str(day)
-    return int(year + month + day)
-
-
-def parse_date(released):
-    """
-    30 June 1997
-    8. february 1980
-    March 1974
-    1974
-    """
-    month = '06'
-    day = '15'
-    year = ''
-    tokens = released.split()
-    if len(tokens) == 1:
-        year = released
-    elif len(tokens) ==2:
-        month = get_month_from_word(tokens[0])
-        year = tokens[1]
-    else:
-        day = get_day_from_str(tokens[0].strip('.'))
-        month = get_month_from_word(tokens[1])
-        year = tokens[2]
-    return int(year + month + day)
-
-
-def get_month_from_word(word):
-    month = re.search(MONTHS_RE, word, flags=re.IGNORECASE)
-    month = month.group()
-    month = MONTHS[month.lower()]
-    return '{:0>2}'.format(month)
-
-
-def get_day_from_str(word):
-    day = int(word)
-    return '{:0>2}'.format(day)
-         
-
-# For song title:
-
-def get_numeric_year(release):
-    year = re.search('\d{4}', release)
-    if not year:
-        return
-    return year.group()
-
-
-def get_month(release):
-    if re.search('[a-zA-Z]', release):
-        month = re.search(MONTHS_RE, release, flags=re.IGNORECASE)
-        if month:
-            month = month.group()
-            return MONTHS[month.lower()]
-    return get_numeric_month(release)
-
-
-def get_numeric_month(release):
-    if re.search('\.', release):
-        tokens = release.split('.')
-        digit_month = re.match('\d+', tokens[1])
-        if digit_month:
-            return digit_month.group()
-
-
 ###
 ##  UTIL
 #
@@ -508,11 +775,53 @@ def read_json(fileName):
 
 
 def write_to_file(fileName, contents):
+    """Doesn't touch the file if it already has the same contents."""
+    if os.path.isfile(fileName):
+        with open(fileName) as f:
+            if f.read() == contents:
+                return
     f = open(fileName,'w')
     f.write(contents) 
     f.close()
 
 
+FileInfo = collections.namedtuple('FileInfo', 'name size mtime')
+
+
+@functools.lru_cache()
+def get_dir_index(path):
+    """Returns dict of files in directory, read with a single scandir."""
+    out = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                out[entry.name] = FileInfo(entry.name, stat.st_size, 
+                                           stat.st_mtime_ns)
+    return out
+
+
+@contextlib.contextmanager
+def open_atomic(fileName):
+    """Opens temporary file for writing, that replaces the 'fileName' on exit,
+    but only if their contents differ. Yields None if 'fileName' is None."""
+    if not fileName:
+        yield None
+        return
+    tempName = f'{fileName}.tmp'
+    try:
+        with open(tempName, 'w', buffering=WRITE_BUFFER) as f:
+            yield f
+    except BaseException:
+        os.remove(tempName)
+        raise
+    if os.path.isfile(fileName) and filecmp.cmp(tempName, fileName, 
+                                                shallow=False):
+        os.remove(tempName)
+    else:
+        os.replace(tempName, fileName)
+
+
 def replace_chars(a_str, chars):
     for ch_from, ch_to in chars:
         a_str = a_str.replace(ch_from, ch_to)
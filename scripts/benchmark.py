@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+#
+# Usage: benchmark.py [NAME ...]
+# Times optimized parts of the scripts against their naive versions on
+# generated data. Runs all benchmarks if no name is specified. Benchmark
+# 'startup' also prints import times of 'parse.py --help' and exits with 
+# status 1 if it goes over budget or imports any of the heavy modules.
+
+import array
+import collections
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import timeit
+
+import numpy as np
+
+import find_connections
+import jsonize
+import plot
+
+
+REPEAT = 5
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+STARTUP_BUDGET = 0.25
+HEAVY_MODULES = ['matplotlib', 'numpy', 'PIL']
+N_SLOWEST_IMPORTS = 10
+N_VALUES = 10**6
+GRAPH_SIZES = [10**5, 10**6]
+BETWEENNESS_SAMPLES = 10
+ORIGINS = ['England', 'International', 'West Coast', 'East Coast', 
+           'Central United States']
+
+
+def main():
+    names = sys.argv[1:] or BENCHMARKS.keys()
+    for name in names:
+        print(f'{name}:')
+        BENCHMARKS[name]()
+
+
+###
+##  CLEANUP
+#
+
+def benchmark_cleanup():
+    text = get_reference_heavy_infobox(n_refs=2000)
+    assert jsonize.cleanup(text) == cleanup_chain(text) == cleanup_fused(text)
+    print_times(len(text), 'chars', compiled=lambda: jsonize.cleanup(text), 
+                chain=lambda: cleanup_chain(text), 
+                fused=lambda: cleanup_fused(text))
+
+
+def get_reference_heavy_infobox(n_refs):
+    out = ['{{Infobox single <!-- See Template:Song infobox -->\n']
+    for i in range(n_refs):
+        out.append(f'| Field{i} = [[Value {i}]]<ref name="r{i}">{{{{cite web'
+                   f'|url=http://www.allmusic.com/style/electro-ma00000{i}'
+                   f'|title=Electro Music Genre Overview - AllMusic'
+                   f'|website=AllMusic|accessdate=26 August 2017}}}}</ref>'
+                   f'<br />(<small>{i}</small>)<ref name="r{i}"/>\n')
+        out.append(f'| Misc{i} = <div style="x">Misc&nbsp;{i}</div>'
+                   f'<!-- Comment {i} -->\n')
+    out.append('}}\n')
+    return ''.join(out)
+
+
+def cleanup_chain(line):
+    """Cleanup as a chain of passes over the whole text."""
+    line = re.sub('&nbsp;', ' ', line)
+    line = re.sub('<br.*?>', ', ', line)
+    line = re.sub('<ref.*?>.*?</ref>', '', line, flags=re.DOTALL)
+    line = re.sub('<ref.*?/>', '', line, flags=re.DOTALL)
+    line = re.sub('</*div.*?>', '', line, flags=re.DOTALL)
+    line = re.sub('<!--.*?-->', '', line)
+    return re.sub('</*small>', '', line, flags=re.IGNORECASE)
+
+
+CLEANUP_RE = re.compile('(&nbsp;)|(<br[^\n]*?>)|<ref.*?>.*?</ref>|<ref.*?/>'
+                        '|</*div.*?>|<!--[^\n]*?-->|</*(?i:small)>', 
+                        flags=re.DOTALL)
+CLEANUP_REPLACEMENTS = ('', ' ', ', ')
+
+
+def cleanup_fused(line):
+    """Cleanup as a single pass with alternation of all patterns. It is slower
+    than the chain, because alternation disables the literal prefix search and
+    calls back into Python for every match."""
+    return CLEANUP_RE.sub(lambda a: CLEANUP_REPLACEMENTS[a.lastindex or 0], 
+                          line)
+
+
+###
+##  STARTUP
+#
+
+def benchmark_startup():
+    command = [sys.executable, '-X', 'importtime', 'parse.py', '--help']
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=PROJECT_DIR, capture_output=True,
+                            text=True, check=True)
+    duration = time.perf_counter() - start
+    imports = get_import_times(result.stderr)
+    print(f'  startup: {duration*1000:.1f} ms (budget {STARTUP_BUDGET*1000:.0f} '
+          'ms)')
+    top_level = [(module, time) for depth, module, time in imports if depth==1]
+    for module, cumulative in sorted(top_level, key=lambda a: -a[1]) \
+                                  [:N_SLOWEST_IMPORTS]:
+        print(f'  {module:<30} {cumulative/1000:7.2f} ms')
+    heavy = [module for _, module, _ in imports 
+                 if module.split('.')[0] in HEAVY_MODULES]
+    if heavy:
+        print(f'  Heavy modules imported: {", ".join(heavy)}', file=sys.stderr)
+    if heavy or duration > STARTUP_BUDGET:
+        sys.exit(1)
+
+
+def get_import_times(importtime_output):
+    """Returns list of imports from the output of 'python -X importtime' as
+    (depth, module, cumulative time in microseconds) tuples."""
+    out = []
+    for line in importtime_output.splitlines():
+        match = re.match('import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)', line)
+        if match:
+            out.append((len(match.group(2)), match.group(3), 
+                        int(match.group(1))))
+    return out
+
+
+###
+##  HISTOGRAM
+#
+
+def benchmark_histogram():
+    rnd = random.Random(0)
+    years = sorted(rnd.randint(1954, 2004) for _ in range(N_VALUES))
+    assert plot.get_histogram(np.array(years))[1].tolist() == \
+               counts_per_year(years)
+    print_times(N_VALUES, 'years', bincount=lambda: plot.get_histogram(
+                    np.array(years)), count=lambda: counts_per_year(years))
+    bpms = [rnd.randint(50, 220) for _ in range(N_VALUES)]
+    assert plot.get_bpm_windows(np.array(bpms)).tolist() == \
+               [get_bpm_window(a) for a in bpms]
+    print_times(N_VALUES, 'BPMs', vectorized=lambda: plot.get_bpm_windows(
+                    np.array(bpms)), loop=lambda: [get_bpm_window(a) for a in 
+                                                   bpms])
+    songs = {i: {'origin': rnd.choice(ORIGINS), 'released_year': a} 
+                 for i, a in enumerate(years)}
+    dataset = plot.get_dataset(songs)
+    assert plot.get_origin_dict(dataset) == get_origin_dict_loop(songs)
+    print_times(N_VALUES, 'songs', dataset=lambda: plot.get_dataset(songs),
+                matrix=lambda: plot.get_origin_dict(dataset),
+                loop=lambda: get_origin_dict_loop(songs))
+
+
+def counts_per_year(listOfYears):
+    """Counts with a pass over sorted years for every year in range."""
+    out = []
+    for year in range(listOfYears[0], listOfYears[-1]+1):
+        out.append(listOfYears.count(year))
+    return out
+
+
+def get_bpm_window(bpm):
+    if plot.NORMALIZE_BPM:
+        if bpm > 140:
+            bpm = int(bpm/2)
+        if bpm < 70:
+            bpm = int(bpm*2)
+    return bpm // plot.BPM_WINDOW
+
+
+def get_origin_dict_loop(songs):
+    out = {}
+    a_sum = collections.Counter()
+    for song in songs.values():
+        if 'origin' not in song or not song.get('released_year'):
+            continue
+        year = song['released_year']
+        origin = song['origin']
+        decade = min(4, (year - 1954)//10)
+        decades = out.get(origin, [0]*5)
+        decades[decade] += 1
+        out[origin] = decades
+        a_sum[decade] += 1
+    for origin in out:
+        for i in range(len(out[origin])):
+            out[origin][i] /= a_sum[i]
+    return out
+
+
+###
+##  CONNECTIONS
+#
+
+def benchmark_connections():
+    for n_songs in GRAPH_SIZES:
+        graph = get_synthetic_graph(n_songs)
+        assert find_connections.get_interesting_nodes(graph) == \
+                   get_interesting_nodes_filters(graph)
+        print_times(n_songs, 'songs', 
+                    fused=lambda: find_connections.get_interesting_nodes(graph),
+                    filters=lambda: get_interesting_nodes_filters(graph))
+    graph = get_synthetic_graph(GRAPH_SIZES[0])
+    offsets, targets = find_connections.get_simple_adjacency(
+                           graph, find_connections.PATH_EDGES)
+    nodes = list(range(len(graph.names)))
+    args = offsets, targets, nodes, BETWEENNESS_SAMPLES
+    assert all(math.isclose(a, b, abs_tol=1e-9) for a, b in 
+                   zip(find_connections.get_betweenness(*args), 
+                       get_betweenness_loop(*args)))
+    print_times(len(targets), 'edges', 
+                levels=lambda: find_connections.get_betweenness(*args),
+                loop=lambda: get_betweenness_loop(*args))
+
+
+def get_synthetic_graph(n_songs):
+    """Graph where each song has an artist, two writers and a producer, drawn
+    from pools of people that are a fraction of the number of songs."""
+    rnd = random.Random(0)
+    n_artists, n_people = n_songs // 5, n_songs // 2
+    names = [f'Song {i}' for i in range(n_songs)] + \
+            [f'artist {i}' for i in range(n_artists)] + \
+            [f'person {i}' for i in range(n_people)]
+    node_types = array.array('b', [find_connections.SONG]) * n_songs + \
+                 array.array('b', [find_connections.VALUE]) * \
+                     (n_artists + n_people)
+    edge_names = ['artist', 'writer', 'producer']
+    edge_songs, edge_nodes = array.array('i'), array.array('i')
+    edge_codes = array.array('H')
+    for song in range(n_songs):
+        nodes = [n_songs + rnd.randrange(n_artists)] + \
+                [n_songs + n_artists + rnd.randrange(n_people) 
+                     for _ in range(3)]
+        edge_songs.extend([song] * 4)
+        edge_nodes.extend(nodes)
+        edge_codes.extend([0, 1, 1, 2])
+    adjacency = find_connections.get_adjacency(len(names), edge_songs, 
+                                               edge_nodes, edge_codes)
+    ids = {name: i for i, name in enumerate(names)}
+    return find_connections.Graph(ids, names, node_types, *adjacency, 
+                                  edge_names)
+
+
+def get_interesting_nodes_filters(graph):
+    """Two filter passes that look up artist of a song for every edge."""
+    nodes = [n for n in graph.ids.values() 
+                 if find_connections.get_degree(graph, n) > 1 and
+                    graph.node_types[n] == find_connections.VALUE]
+    nodes = [n for n in nodes if node_has_multiple_songs(graph, n)]
+    return [n for n in nodes if has_multiple_artist(graph, n)]
+
+
+def node_has_multiple_songs(graph, node):
+    songs = graph.targets[graph.offsets[node]:graph.offsets[node+1]]
+    return any(song != songs[0] for song in songs)
+
+
+def has_multiple_artist(graph, node):
+    songs = graph.targets[graph.offsets[node]:graph.offsets[node+1]]
+    first_artist = get_artist(graph, songs[0])
+    if first_artist is None:
+        return False
+    return any(get_artist(graph, song) != first_artist for song in songs)
+
+
+def get_artist(graph, song):
+    if 'artist' not in graph.edge_names:
+        return None
+    artist = graph.edge_names.index('artist')
+    for edge_type, target in find_connections.get_edges(graph, song):
+        if edge_type == artist:
+            return target
+
+
+def get_betweenness_loop(offsets, targets, nodes, samples, seed=0):
+    """Brandes' algorithm that visits one node at a time."""
+    n_nodes = len(offsets) - 1
+    out = array.array('d', bytes(8 * n_nodes))
+    sources = nodes
+    if len(nodes) > samples:
+        sources = random.Random(seed).sample(nodes, samples)
+    # Each path is counted from both of its ends.
+    scale = len(nodes) / max(1, len(sources)) / 2
+    # Arrays are shared by all sources and only reset where they were used.
+    distance = array.array('i', [-1]) * n_nodes
+    paths = array.array('d', bytes(8 * n_nodes))
+    dependency = array.array('d', bytes(8 * n_nodes))
+    for source in sources:
+        distance[source], paths[source] = 0, 1
+        order = [source]
+        for node in order:
+            next_distance = distance[node] + 1
+            for target in targets[offsets[node]:offsets[node+1]]:
+                if distance[target] < 0:
+                    distance[target] = next_distance
+                    order.append(target)
+                if distance[target] == next_distance:
+                    paths[target] += paths[node]
+        for node in reversed(order):
+            parent_distance = distance[node] - 1
+            share = (1 + dependency[node]) / paths[node]
+            for parent in targets[offsets[node]:offsets[node+1]]:
+                if distance[parent] == parent_distance:
+                    dependency[parent] += paths[parent] * share
+            if node != source:
+                out[node] += dependency[node] * scale
+        for node in order:
+            distance[node], paths[node], dependency[node] = -1, 0, 0
+    return out
+
+
+###
+##  UTIL
+#
+
+def print_times(size, unit, **functions):
+    print(f'  input: {size} {unit}')
+    for name, function in functions.items():
+        time = min(timeit.repeat(function, number=1, repeat=REPEAT))
+        print(f'  {name:<12} {time*1000:9.2f} ms')
+
+
+BENCHMARKS = {'cleanup': benchmark_cleanup,
+              'histogram': benchmark_histogram,
+              'connections': benchmark_connections,
+              'startup': benchmark_startup}
+
+
+if __name__ == '__main__':
+    main()
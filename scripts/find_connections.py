@@ -1,114 +1,949 @@
 #!/usr/bin/env python3
 #
-# Usage: find_connections.py 
-# Finds interesting connections in wiki_data.json
-
-import re
+# Usage: find_connections.py [--no-snapshot]
+#        find_connections.py connect SONG_OR_NAME SONG_OR_NAME [--via EDGE ...]
+#        find_connections.py neighbors SONG_OR_NAME [--hops K] [--via EDGE ...]
+#        find_connections.py top [-k K]
+#        find_connections.py analyze [-k K] [--samples N] [--output FILE]
+# Finds interesting connections in wiki_data.json. Connections are kept in a
+# compact graph, with nodes identified by index and edges of all nodes stored 
+# in a few flat arrays. Command 'connect' prints the shortest chain between two
+# songs or people, 'neighbors' prints everything within K hops and 'top' prints
+# people that are connected to the most songs. By default chains only go 
+# through people and labels. Command 'analyze' saves connected components, 
+# most central nodes and people that bridge clusters of artists into 
+# 'connections.json', that parse.py also builds for the site. Betweenness is
+# computed with NumPy, that is only imported by 'analyze'.
+# Graph is saved into snapshot 'connections.bin', that gets memory mapped by
+# the next run. If 'wiki_data.json' changed, only edges of songs whose hash 
+# changed get replaced.
+
+import argparse
+import array
+import bisect
+import collections
+import collections.abc
+import hashlib
+import heapq
 import json
+import mmap
+import os
+import random
+import re
+import sys
 
 
 JSON_FILE = '../data/wiki_data.json'
+SNAPSHOT_FILE = '../data/connections.bin'
+ANALYTICS_FILE = '../data/connections.json'
+SNAPSHOT_MAGIC = b'CONNGRPH'
+ALIGNMENT = 8
 IGNORE_EDGES = 'type|prev_year|next_year|caption|format|track_no|length|genre' \
                '|recorded|key|bpm|origin'
-
-
-class Node:
-    def __init__(self, name, a_type=None):
-        self.name = name
-        self.edges = []
-        self.a_type = a_type
-    def __repr__(self):
-        return str('{}: {}'.format(self.name, ', '.join(str(e) for e in self.edges)))
-
-
-class Edge:
-    def __init__(self, name, song, obj_b):
-        self.name = name
-        self.song = song
-        self.obj_b = obj_b
-    def __repr__(self):
-        return self.name
+PEOPLE_EDGES = ['artist', 'writer', 'producer', 'composer', 'lyricist']
+PATH_EDGES = PEOPLE_EDGES + ['label']
+# Betweenness is estimated from this many randomly chosen sources if graph has
+# more nodes. Each source costs a pass over all edges, about 0.1 s per million
+# edges.
+BETWEENNESS_SAMPLES = 100
+# Number of listed components and most central nodes.
+ANALYTICS_SIZE = 10
+
+
+# Node types. Removed songs are only left in updated snapshots.
+VALUE, SONG, REMOVED = 0, 1, 2
+
+# Nodes are identified by their index. 'ids' maps name to index. Edges of node
+# 'i' are at indices 'offsets[i]' to 'offsets[i+1]' of arrays 'targets', that
+# holds indices of nodes at the other end, and 'edge_types', that holds indices
+# into 'edge_names'.
+Graph = collections.namedtuple('Graph', 'ids names node_types offsets targets '
+                                        'edge_types edge_names')
+
+# Edges of each song in the order of songs, so that they can be replaced when
+# song changes. Edges of song 'i' are at indices 'edge_offsets[i]' to 
+# 'edge_offsets[i+1]' of 'edge_nodes' and 'edge_codes'. Hashes are 
+# 'HASH_SIZE' bytes long.
+SongTable = collections.namedtuple('SongTable', 'nodes hashes edge_offsets '
+                                                'edge_nodes edge_codes')
+HASH_SIZE = 20
 
 
 def main():
-    songs = read_json_file(JSON_FILE)
-    nodes = {}
-
+    args = get_parser().parse_args()
+    if args.no_snapshot:
+        graph = get_graph(read_json_file(JSON_FILE))
+    else:
+        graph = get_snapshot_graph(JSON_FILE, SNAPSHOT_FILE)
+    if not args.command:
+        print_out(graph)
+    elif args.command == 'top':
+        print_top(graph, args.k)
+    elif args.command == 'analyze':
+        write_json_file(args.output, get_analytics(graph, args.k, 
+                                                   args.samples))
+    else:
+        nodes = [get_node(graph, a) for a in args.names]
+        if None in nodes:
+            name = args.names[nodes.index(None)]
+            print(f'Song or name not found: {name}', file=sys.stderr)
+            sys.exit(1)
+        if args.command == 'connect':
+            print_path(graph, get_path(graph, *nodes, args.via))
+        else:
+            print_neighborhood(graph, get_neighborhood(graph, *nodes, 
+                                                       args.hops, args.via))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Finds connections between '
+                                                 'songs.')
+    parser.add_argument('--no-snapshot', action='store_true',
+                        help='build graph from json without using snapshot')
+    subparsers = parser.add_subparsers(dest='command')
+    connect = subparsers.add_parser('connect', help='shortest chain between '
+                                                    'two songs or people')
+    connect.add_argument('names', nargs=2, metavar='SONG_OR_NAME')
+    neighbors = subparsers.add_parser('neighbors', help='songs and people '
+                                                        'within K hops')
+    neighbors.add_argument('names', nargs=1, metavar='SONG_OR_NAME')
+    neighbors.add_argument('--hops', type=int, default=2, metavar='K')
+    for a in connect, neighbors:
+        a.add_argument('--via', nargs='+', default=PATH_EDGES, metavar='EDGE',
+                       help='types of edges to follow (default: '
+                            f'{" ".join(PATH_EDGES)})')
+    top = subparsers.add_parser('top', help='people connected to the most '
+                                            'songs')
+    top.add_argument('-k', type=int, default=10)
+    analyze = subparsers.add_parser('analyze', help='save components, '
+                                    'centrality and bridge people as json')
+    analyze.add_argument('-k', type=int, default=ANALYTICS_SIZE, 
+                         help='number of listed nodes and components')
+    analyze.add_argument('--samples', type=int, default=BETWEENNESS_SAMPLES,
+                         metavar='N', help='number of sources for estimating '
+                                           'betweenness')
+    analyze.add_argument('--output', default=ANALYTICS_FILE, metavar='FILE')
+    return parser
+
+
+def get_graph(songs):
+    """Connects songs with values of their attributes. Edges are collected into
+    flat arrays and then sorted by node into adjacency arrays."""
+    graph, _ = build_graph(songs)
+    return graph
+
+
+def build_graph(songs, hashes=None):
+    """Returns graph and song table. Table gets songs' hashes from 'hashes' if
+    it is specified."""
+    ids, names, node_types = {}, [], array.array('b')
+    table = get_empty_table()
+    edge_names, codes = [], {}
     for title, song in songs.items():
-        song_o = Node(title, 'song')
-        nodes[title] = song_o
-        for key, value in song.items():
-            if isinstance(value, dict):
+        song_id = add_node(title, SONG, ids, names, node_types)
+        table.nodes.append(song_id)
+        if hashes:
+            table.hashes.extend(hashes[title])
+        for code, name in get_song_edges(song, codes, edge_names):
+            node_id = ids.get(name)
+            if node_id is None:
+                node_id = add_node(name, VALUE, ids, names, node_types)
+            table.edge_nodes.append(node_id)
+            table.edge_codes.append(code)
+        table.edge_offsets.append(len(table.edge_nodes))
+    offsets, targets, edge_types = get_adjacency(len(names), 
+                                                 get_edge_songs(table), 
+                                                 table.edge_nodes, 
+                                                 table.edge_codes)
+    graph = Graph(ids, names, node_types, offsets, targets, edge_types, 
+                  edge_names)
+    return graph, table
+
+
+def get_song_edges(song, codes, edge_names):
+    """Yields (edge code, node name) pairs of song's attributes."""
+    for key, value in song.items():
+        code = get_edge_code(key, codes, edge_names)
+        if code is None or isinstance(value, dict):
+            continue
+        values = value if isinstance(value, list) else [value]
+        for v in values:
+            if not isinstance(v, str):
                 continue
-            if isinstance(value, list):
-                for v in value:
-                    connect(song_o, key, v, nodes)
-            if isinstance(value, str):
-                connect(song_o, key, value, nodes)
-
-    print_out(nodes)
-
-
-def print_out(nodes):
-    interesting_nodes = [n for n in nodes.values() 
-                            if len(n.edges)>1 and not n.a_type]
-    interesting_nodes = filter_nodes_that_connect_to_single_song(interesting_nodes)
-    interesting_nodes = filter_nodes_that_have_single_artist(interesting_nodes)
-    if not interesting_nodes:
-        return
-    for n in interesting_nodes:
-        print(n.name)
-        for e in n.edges:
-            print(e.name, ': ', e.song.name)
+            name = v.lower()
+            if edge_names[code] == 'label':
+                name = remove_brackets(name)
+            yield code, name
+
+
+def get_empty_table():
+    return SongTable(array.array('i'), bytearray(), array.array('q', [0]), 
+                     array.array('i'), array.array('H'))
+
+
+def get_edge_songs(table):
+    """Returns song of each edge in the table."""
+    out = array.array('i')
+    for i, node in enumerate(table.nodes):
+        n_edges = table.edge_offsets[i+1] - table.edge_offsets[i]
+        out.extend(array.array('i', [node]) * n_edges)
+    return out
+
+
+def add_node(name, node_type, ids, names, node_types):
+    """Adds node even if name exists, in which case name gets assigned to the
+    new node."""
+    ids[name] = len(names)
+    names.append(sys.intern(name))
+    node_types.append(node_type)
+    return ids[name]
+
+
+def get_edge_code(key, codes, edge_names):
+    """Returns index of edge's name or None if edge is ignored. Each key is 
+    only checked once."""
+    if key not in codes:
+        edge_name = key.lower()
+        if equals_ic(IGNORE_EDGES, edge_name):
+            codes[key] = None
+        else:
+            if edge_name not in edge_names:
+                edge_names.append(edge_name)
+            codes[key] = edge_names.index(edge_name)
+    return codes[key]
+
+
+def get_adjacency(n_nodes, edge_songs, edge_nodes, edge_codes):
+    """Returns offsets, targets and edge types. Edges of each node keep the 
+    order in which they were added."""
+    offsets = array.array('q', bytes(8 * (n_nodes+1)))
+    for song, node in zip(edge_songs, edge_nodes):
+        offsets[song+1] += 1
+        offsets[node+1] += 1
+    for i in range(n_nodes):
+        offsets[i+1] += offsets[i]
+    targets = array.array('i', bytes(4 * offsets[-1]))
+    edge_types = array.array('H', bytes(2 * offsets[-1]))
+    position = offsets[:-1]
+    for song, node, code in zip(edge_songs, edge_nodes, edge_codes):
+        for a, b in ((song, node), (node, song)):
+            targets[position[a]] = b
+            edge_types[position[a]] = code
+            position[a] += 1
+    return offsets, targets, edge_types
+
+
+def get_edges(graph, node):
+    """Returns (edge type, target) pairs of node."""
+    start, end = graph.offsets[node], graph.offsets[node+1]
+    return zip(graph.edge_types[start:end], graph.targets[start:end])
+
+
+def get_degree(graph, node):
+    return graph.offsets[node+1] - graph.offsets[node]
+
+
+def print_out(graph):
+    for n in get_interesting_nodes(graph):
+        print(graph.names[n])
+        for edge_type, song in get_edges(graph, n):
+            print(graph.edge_names[edge_type], ': ', graph.names[song])
         print()
 
 
-def filter_nodes_that_connect_to_single_song(nodes):
-    return [n for n in nodes if node_has_multiple_songs(n)]
+def get_interesting_nodes(graph):
+    """Returns nodes that are not songs and connect songs of different artists,
+    in a single pass over their edges. Node connects to multiple songs if it
+    connects to multiple artists, so songs don't need to be checked."""
+    artists = get_artists(graph)
+    out = []
+    for node in graph.ids.values():
+        start, end = graph.offsets[node], graph.offsets[node+1]
+        if end - start < 2 or graph.node_types[node] != VALUE:
+            continue
+        songs = graph.targets[start:end]
+        first_artist = artists[songs[0]]
+        if first_artist < 0:
+            continue
+        if any(artists[song] != first_artist for song in songs):
+            out.append(node)
+    return out
+
+
+def get_artists(graph):
+    """Returns array with index of the first artist of each song or -1 if song
+    has no artist or node is not a song."""
+    out = array.array('i', [-1]) * len(graph.names)
+    if 'artist' not in graph.edge_names:
+        return out
+    artist = graph.edge_names.index('artist')
+    for node, node_type in enumerate(graph.node_types):
+        if node_type != SONG:
+            continue
+        for edge_type, target in get_edges(graph, node):
+            if edge_type == artist:
+                out[node] = target
+                break
+    return out
 
 
-def node_has_multiple_songs(node):
-    if len(node.edges) < 2:
-        return False
-    first_song = node.edges[0].song.name
-    for edge in node.edges:
-        if edge.song.name != first_song:
-            return True
-
+###
+##  QUERIES
+#
+# Queries only read the graph, so it can be built once and queried many times.
+
+def get_node(graph, name):
+    """Returns index of song or other node. Names of other nodes are in lower
+    case."""
+    if name in graph.ids:
+        return graph.ids[name]
+    return graph.ids.get(name.lower())
+
+
+def get_path(graph, source, target, edge_names=PATH_EDGES):
+    """Returns shortest path as a list of (edge type, node) pairs, where edge
+    type of the source is None, or None if nodes are not connected. Searches
+    from both ends and always expands the smaller frontier by a whole level."""
+    followed = get_followed(graph, edge_names)
+    # Node: (parent, edge type, depth)
+    visited = [{source: (None, None, 0)}, {target: (None, None, 0)}]
+    frontiers = [[source], [target]]
+    meets = [source] if source == target else []
+    while not meets and frontiers[0] and frontiers[1]:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        own, other = visited[side], visited[1-side]
+        frontier = []
+        for node in frontiers[side]:
+            depth = own[node][2] + 1
+            for edge_type, neighbor in get_edges(graph, node):
+                if not followed[edge_type] or neighbor in own:
+                    continue
+                own[neighbor] = (node, edge_type, depth)
+                if neighbor in other:
+                    meets.append(neighbor)
+                else:
+                    frontier.append(neighbor)
+        frontiers[side] = frontier
+    if not meets:
+        return None
+    meet = min(meets, key=lambda a: visited[0][a][2] + visited[1][a][2])
+    return join_path(visited, meet)
+
+
+def join_path(visited, meet):
+    out = []
+    node, edge_type = meet, None
+    while node is not None:
+        parent, parent_edge, _ = visited[0][node]
+        out.append((parent_edge, node))
+        node = parent
+    out.reverse()
+    node = meet
+    while True:
+        parent, edge_type, _ = visited[1][node]
+        if parent is None:
+            return out
+        out.append((edge_type, parent))
+        node = parent
+
+
+def get_neighborhood(graph, node, hops, edge_names=PATH_EDGES):
+    """Returns dict of nodes within 'hops' edges and their distance, in the
+    order of breadth-first search."""
+    followed = get_followed(graph, edge_names)
+    out = {node: 0}
+    frontier = [node]
+    for distance in range(1, hops+1):
+        next_frontier = []
+        for a in frontier:
+            for edge_type, neighbor in get_edges(graph, a):
+                if followed[edge_type] and neighbor not in out:
+                    out[neighbor] = distance
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+    return out
+
+
+def get_top(graph, k, edge_names=PEOPLE_EDGES):
+    """Returns 'k' (node, number of songs) pairs of people connected to the 
+    most songs. People are nodes with edges of types in 'edge_names'."""
+    followed = get_followed(graph, edge_names)
+    counts = ((node, len({target for edge_type, target in 
+                              get_edges(graph, node) if followed[edge_type]}))
+                  for node, node_type in enumerate(graph.node_types)
+                  if node_type == VALUE)
+    return heapq.nlargest(k, counts, key=lambda a: a[1])
+
+
+def get_followed(graph, edge_names):
+    """Returns list that tells for each edge type if it should be followed."""
+    return [a in edge_names for a in graph.edge_names]
+
+
+def print_path(graph, path):
+    if not path:
+        print('Not connected.')
+        return
+    for edge_type, node in path:
+        if edge_type is not None:
+            print(f'  {graph.edge_names[edge_type]}')
+        print(graph.names[node])
 
-def filter_nodes_that_have_single_artist(nodes):
-    return [n for n in nodes if has_multiple_artist(n)]
 
+def print_neighborhood(graph, neighborhood):
+    for node, distance in neighborhood.items():
+        print(distance, graph.names[node], sep='  ')
 
-def has_multiple_artist(node):
-    first_song = node.edges[0].song
-    if not first_song:
-        return
-    first_artist = get_artist(first_song)
-    if not first_artist:
-        return
-    for edge in node.edges:
-        if get_artist(edge.song) != first_artist:
-            return True
 
+def print_top(graph, k):
+    for node, count in get_top(graph, k):
+        print(f'{count:4}  {graph.names[node]}')
 
-def get_artist(song):
-    for edge in song.edges:
-        if edge.name == 'artist':
-            return edge.obj_b.name
 
+###
+##  ANALYTICS
+#
+# Analytics run on a simple graph with only edges of types in 'PATH_EDGES', 
+# held in offsets and targets arrays like the full graph. Nodes without such 
+# edges are left out, unless they are songs.
+
+def analyze(songs, filename=ANALYTICS_FILE, k=ANALYTICS_SIZE, 
+            samples=BETWEENNESS_SAMPLES):
+    """Saves analytics of the graph of already loaded songs into json file."""
+    write_json_file(filename, get_analytics(get_graph(songs), k, samples))
+
+
+def get_analytics(graph, k, samples, edge_names=PATH_EDGES):
+    """Returns dict with connected components, 'k' nodes with the highest 
+    degree and betweenness, and people that connect separate clusters of 
+    artists."""
+    offsets, targets = get_simple_adjacency(graph, edge_names)
+    nodes = [a for a in range(len(graph.names)) if graph.node_types[a] == SONG
+                 or offsets[a+1] > offsets[a]]
+    kinds = get_kinds(graph)
+    components = get_components(offsets, targets, nodes)
+    degrees = [(a, offsets[a+1] - offsets[a]) for a in nodes]
+    betweenness = get_betweenness(offsets, targets, nodes, samples)
+    bridges = get_bridges(offsets, targets, nodes, kinds)
+    n_others = max(1, len(nodes) - 1)
+    return {
+        'nodes': len(nodes),
+        'edges': len(targets) // 2,
+        'components': {
+            'count': len(components),
+            'largest': [{'nodes': len(a), 
+                         'songs': [graph.names[b] for b in a 
+                                       if kinds[b] == 'song']}
+                            for a in heapq.nlargest(k, components, key=len)]},
+        'degree': [{'name': graph.names[a], 'type': kinds[a], 'degree': b,
+                    'centrality': b / n_others}
+                       for a, b in heapq.nlargest(k, degrees, 
+                                                  key=lambda a: a[1])],
+        'betweenness': [{'name': graph.names[a], 'type': kinds[a], 
+                         'centrality': betweenness[a]}
+                            for a in heapq.nlargest(k, nodes, 
+                                                    key=betweenness.__getitem__)
+                            if betweenness[a] > 0],
+        'bridges': [{'name': graph.names[a], 'artist_clusters': b}
+                        for a, b in sorted(bridges.items(), 
+                                           key=lambda a: -a[1])]
+    }
+
+
+def get_simple_adjacency(graph, edge_names):
+    """Returns offsets and targets with only followed edges and without 
+    repeated edges and loops."""
+    followed = get_followed(graph, edge_names)
+    offsets, targets = array.array('q', [0]), array.array('i')
+    for node in range(len(graph.names)):
+        targets.extend(dict.fromkeys(b for a, b in get_edges(graph, node)
+                                         if followed[a] and b != node))
+        offsets.append(len(targets))
+    return offsets, targets
+
+
+def get_kinds(graph):
+    """Returns kind of each node, that is 'song', 'artist', 'person' or 
+    'other'. Artists are people that are song's artist."""
+    artist = graph.edge_names.index('artist') \
+                 if 'artist' in graph.edge_names else None
+    people = get_followed(graph, PEOPLE_EDGES)
+    out = []
+    for node, node_type in enumerate(graph.node_types):
+        if node_type == SONG:
+            out.append('song')
+            continue
+        edge_types = set(graph.edge_types[graph.offsets[node]:
+                                          graph.offsets[node+1]])
+        if artist in edge_types:
+            out.append('artist')
+        elif any(people[a] for a in edge_types):
+            out.append('person')
+        else:
+            out.append('other')
+    return out
+
+
+def get_components(offsets, targets, nodes):
+    """Returns list of connected components, each of them a list of nodes."""
+    component = array.array('i', [-1]) * (len(offsets) - 1)
+    out = []
+    for root in nodes:
+        if component[root] >= 0:
+            continue
+        component[root] = len(out)
+        members = [root]
+        for node in members:
+            for target in targets[offsets[node]:offsets[node+1]]:
+                if component[target] < 0:
+                    component[target] = len(out)
+                    members.append(target)
+        out.append(members)
+    return out
+
+
+def get_betweenness(offsets, targets, nodes, samples, seed=0):
+    """Returns list with betweenness of each node, computed with Brandes' 
+    algorithm. If there are more nodes than 'samples', only paths from that 
+    many random sources are counted and scores are scaled up accordingly. 
+    Breadth-first search expands a whole level with NumPy at once."""
+    import numpy as np
+    offsets, targets = np.asarray(offsets), np.asarray(targets)
+    n_nodes = len(offsets) - 1
+    out = np.zeros(n_nodes)
+    sources = nodes
+    if len(nodes) > samples:
+        sources = random.Random(seed).sample(nodes, samples)
+    # Each path is counted from both of its ends.
+    scale = len(nodes) / max(1, len(sources)) / 2
+    # Arrays are shared by all sources and only reset where they were used.
+    distance = np.full(n_nodes, -1)
+    paths = np.zeros(n_nodes)
+    dependency = np.zeros(n_nodes)
+    # Position of a newly found node in the list of new nodes, that is used for
+    # dropping its repeats.
+    slot = np.zeros(n_nodes, dtype=np.int64)
+    for source in sources:
+        distance[source], paths[source] = 0, 1
+        frontier = np.array([source])
+        visited, levels = [frontier], []
+        while len(frontier):
+            depth = distance[frontier[0]] + 1
+            parents, children = get_level_edges(offsets, targets, frontier)
+            new = children[distance[children] < 0]
+            positions = np.arange(len(new))
+            slot[new] = positions
+            frontier = new[slot[new] == positions]
+            distance[frontier] = depth
+            on_path = distance[children] == depth
+            parents, children = parents[on_path], children[on_path]
+            np.add.at(paths, children, paths[parents])
+            visited.append(frontier)
+            levels.append((parents, children))
+        for parents, children in reversed(levels):
+            np.add.at(dependency, parents, paths[parents] / paths[children] * 
+                                           (1 + dependency[children]))
+        dependency[source] = 0
+        visited = np.concatenate(visited)
+        out[visited] += dependency[visited] * scale
+        distance[visited], paths[visited], dependency[visited] = -1, 0, 0
+    return out.tolist()
+
+
+def get_level_edges(offsets, targets, frontier):
+    """Returns parents and children of all edges of nodes in frontier."""
+    import numpy as np
+    starts = offsets[frontier]
+    degrees = offsets[frontier+1] - starts
+    parents = np.repeat(frontier, degrees)
+    first_edges = np.repeat(starts - (np.cumsum(degrees) - degrees), degrees)
+    return parents, targets[first_edges + np.arange(len(parents))]
+
+
+def get_bridges(offsets, targets, nodes, kinds):
+    """Returns dict of people whose removal would split their component into
+    more than one part with artists, and the number of such parts. Uses 
+    iterative depth-first search that finds articulation points."""
+    n_nodes = len(offsets) - 1
+    visited = array.array('i', [-1]) * n_nodes
+    low = array.array('i', bytes(4 * n_nodes))
+    # Artists in the subtree of depth-first search, in its subtrees that get
+    # separated from the rest by removing the node and number of such subtrees
+    # that have artists.
+    artists = array.array('i', (kind == 'artist' for kind in kinds))
+    separated = array.array('i', bytes(4 * n_nodes))
+    parts = array.array('i', bytes(4 * n_nodes))
+    is_artist = artists[:]
+    out = {}
+    counter = 0
+    for root in nodes:
+        if visited[root] >= 0:
+            continue
+        visited[root] = low[root] = counter
+        counter += 1
+        members = [root]
+        stack = [(root, -1, offsets[root])]
+        while stack:
+            node, parent, i = stack[-1]
+            if i < offsets[node+1]:
+                stack[-1] = (node, parent, i+1)
+                target = targets[i]
+                if visited[target] < 0:
+                    visited[target] = low[target] = counter
+                    counter += 1
+                    members.append(target)
+                    stack.append((target, node, offsets[target]))
+                elif target != parent:
+                    low[node] = min(low[node], visited[target])
+                continue
+            stack.pop()
+            if parent < 0:
+                continue
+            low[parent] = min(low[parent], low[node])
+            artists[parent] += artists[node]
+            if low[node] >= visited[parent]:
+                separated[parent] += artists[node]
+                parts[parent] += artists[node] > 0
+        total = artists[root]
+        for node in members:
+            if kinds[node] not in ('person', 'artist'):
+                continue
+            rest = 0 if node == root else \
+                   total - is_artist[node] - separated[node]
+            n_parts = parts[node] + (rest > 0)
+            if n_parts > 1:
+                out[node] = n_parts
+    return out
 
 
-def connect(song, edge_name, obj_b_name, nodes):
-    edge_name, obj_b_name = edge_name.lower(), obj_b_name.lower()
-    if equals_ic(IGNORE_EDGES, edge_name):
+###
+##  SNAPSHOT
+#
+# Snapshot starts with magic bytes, length of json header and json header, 
+# that holds positions of sections. Sections are arrays that hold graph, 
+# names of nodes and song table. Each of them is aligned to 'ALIGNMENT' bytes,
+# so they can be read straight from the memory mapped file.
+
+Snapshot = collections.namedtuple('Snapshot', 'graph table source')
+
+
+class Names(collections.abc.Sequence):
+    """Names of nodes, encoded as UTF-8 and stored one after another."""
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+    def __getitem__(self, i):
+        return str(self.get_bytes(i), 'utf-8')
+    def __len__(self):
+        return len(self.offsets) - 1
+    def get_bytes(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i+1]])
+    def append(self, name):
+        self.data.extend(name.encode())
+        self.offsets.append(len(self.data))
+
+
+class NameIndex(collections.abc.Mapping):
+    """Maps names to nodes like 'ids' of a built graph. Lookup is a binary 
+    search over nodes sorted by name and index, other methods build a dict on
+    first use. Removed songs are not included in the order."""
+    def __init__(self, names, order, node_types):
+        self.names = names
+        self.order = order
+        self.node_types = node_types
+        self.dict = None
+    def __getitem__(self, name):
+        key = name.encode()
+        i = bisect.bisect_right(self.order, key, key=self.names.get_bytes) - 1
+        if i < 0 or self.names.get_bytes(self.order[i]) != key:
+            raise KeyError(name)
+        return self.order[i]
+    def __iter__(self):
+        return iter(self.get_dict())
+    def __len__(self):
+        return len(self.get_dict())
+    def values(self):
+        return self.get_dict().values()
+    def items(self):
+        return self.get_dict().items()
+    def get_dict(self):
+        if self.dict is None:
+            self.dict = {self.names[i]: i for i in range(len(self.names))
+                             if self.node_types[i] != REMOVED}
+        return self.dict
+
+
+def get_snapshot_graph(json_file, snapshot_file):
+    """Returns graph from snapshot if json file didn't change since it was 
+    written, without reading the json file. Otherwise snapshot gets updated, or
+    rebuilt if it is missing or was written by a different version of the 
+    script."""
+    stat = os.stat(json_file)
+    source = [stat.st_size, stat.st_mtime_ns]
+    settings = get_settings_hash()
+    snapshot = read_snapshot(snapshot_file, settings)
+    if snapshot and snapshot.source == source:
+        return snapshot.graph
+    songs = read_json_file(json_file)
+    hashes = {title: get_song_hash(song) for title, song in songs.items()}
+    if snapshot:
+        graph, table = update_graph(snapshot.graph, snapshot.table, songs, 
+                                    hashes)
+    else:
+        graph, table = build_graph(songs, hashes)
+    write_snapshot(snapshot_file, graph, table, source, settings)
+    return graph
+
+
+def update_graph(graph, table, songs, hashes):
+    """Replaces edges of songs that were added, changed or removed. Adjacency
+    arrays of other nodes are copied in bulk. New nodes are added at the end 
+    and new edges of a node after the old ones, so their order can differ from
+    the one of a new build. The same goes for connections through a song 
+    whose title equals name of another node."""
+    names = Names(array.array('q', graph.names.offsets), 
+                  bytearray(graph.names.data))
+    node_types = array.array('b', graph.node_types)
+    order = array.array('i', graph.ids.order)
+    ids = NameIndex(names, order, node_types)
+    edge_names, codes = list(graph.edge_names), {}
+    slots = {names[node]: i for i, node in enumerate(table.nodes)}
+    new_table = get_empty_table()
+    # Node: list of (edge type, target)
+    new_edges = collections.defaultdict(list)
+    stale = set()
+    # Unchanged songs that follow each other get copied together.
+    run = [0, 0]
+    for title, song in songs.items():
+        slot = slots.pop(title, None)
+        if slot is not None and get_table_hash(table, slot) == hashes[title]:
+            if slot != run[1]:
+                copy_table_songs(table, *run, new_table)
+                run[0] = slot
+            run[1] = slot + 1
+            continue
+        copy_table_songs(table, *run, new_table)
+        run = [0, 0]
+        if slot is None:
+            node = add_snapshot_node(title, SONG, names, node_types, order)
+        else:
+            node = table.nodes[slot]
+            stale.add(node)
+        new_edges.setdefault(node, [])
+        new_table.nodes.append(node)
+        new_table.hashes.extend(hashes[title])
+        for code, name in get_song_edges(song, codes, edge_names):
+            target = ids.get(name)
+            if target is None:
+                target = add_snapshot_node(name, VALUE, names, node_types, 
+                                           order)
+            new_edges[node].append((code, target))
+            new_edges[target].append((code, node))
+            new_table.edge_nodes.append(target)
+            new_table.edge_codes.append(code)
+        new_table.edge_offsets.append(len(new_table.edge_nodes))
+    copy_table_songs(table, *run, new_table)
+    for slot in slots.values():
+        node = table.nodes[slot]
+        stale.add(node)
+        node_types[node] = REMOVED
+        remove_from_order(order, node, names)
+    adjacency = patch_adjacency(graph, len(names), stale, new_edges)
+    graph = Graph(ids, names, node_types, *adjacency, edge_names)
+    return graph, new_table
+
+
+def get_table_hash(table, slot):
+    return bytes(table.hashes[slot*HASH_SIZE:(slot+1)*HASH_SIZE])
+
+
+def copy_table_songs(table, start, end, new_table):
+    """Appends songs from 'start' to 'end' without the end."""
+    if start >= end:
         return
-    if edge_name == 'label':
-        obj_b_name = remove_brackets(obj_b_name)
-    obj_b = nodes.setdefault(obj_b_name, Node(obj_b_name))
-    edge = Edge(edge_name, song, obj_b)
-    song.edges.append(edge)
-    obj_b.edges.append(edge)
+    first, last = table.edge_offsets[start], table.edge_offsets[end]
+    shift = len(new_table.edge_nodes) - first
+    extend_array(new_table.nodes, table.nodes[start:end])
+    new_table.hashes.extend(table.hashes[start*HASH_SIZE:end*HASH_SIZE])
+    extend_array(new_table.edge_nodes, table.edge_nodes[first:last])
+    extend_array(new_table.edge_codes, table.edge_codes[first:last])
+    new_table.edge_offsets.extend(a + shift for a in 
+                                      table.edge_offsets[start+1:end+1])
+
+
+def add_snapshot_node(name, node_type, names, node_types, order):
+    """Adds node after existing nodes with the same name, so that name gets
+    assigned to it."""
+    node = len(names)
+    names.append(name)
+    node_types.append(node_type)
+    bisect.insort_right(order, node, key=names.get_bytes)
+    return node
+
+
+def remove_from_order(order, node, names):
+    key = names.get_bytes(node)
+    i = bisect.bisect_left(order, key, key=names.get_bytes)
+    while order[i] != node:
+        i += 1
+    del order[i]
+
+
+def patch_adjacency(graph, n_nodes, stale, new_edges):
+    """Returns offsets, targets and edge types, where stale songs only keep 
+    their new edges, their old neighbors lose edges to them and nodes get new
+    edges appended."""
+    affected = dict.fromkeys(stale)
+    for song in stale:
+        affected.update(dict.fromkeys(t for _, t in get_edges(graph, song)))
+    affected.update(dict.fromkeys(new_edges))
+    old_offsets = graph.offsets
+    offsets = array.array('q', [0])
+    targets, edge_types = array.array('i'), array.array('H')
+    n_old = len(old_offsets) - 1
+    adjacency = offsets, targets, edge_types
+    start = 0
+    for node in sorted(affected):
+        copy_adjacency(graph, start, min(node, n_old), *adjacency)
+        edges = [] if node in stale or node >= n_old else \
+                [a for a in get_edges(graph, node) if a[1] not in stale]
+        for edge_type, target in edges + new_edges.get(node, []):
+            targets.append(target)
+            edge_types.append(edge_type)
+        offsets.append(len(targets))
+        start = node + 1
+    copy_adjacency(graph, start, n_old, *adjacency)
+    return adjacency
+
+
+def copy_adjacency(graph, start, end, offsets, targets, edge_types):
+    """Appends edges of nodes from 'start' to 'end' without the end."""
+    if start >= end:
+        return
+    first, last = graph.offsets[start], graph.offsets[end]
+    shift = len(targets) - first
+    offsets.extend(a + shift for a in graph.offsets[start+1:end+1])
+    extend_array(targets, graph.targets[first:last])
+    extend_array(edge_types, graph.edge_types[first:last])
+
+
+def write_snapshot(filename, graph, table, source, settings):
+    names = graph.names
+    if not isinstance(names, Names):
+        names = Names(array.array('q', [0]), bytearray())
+        for name in graph.names:
+            names.append(name)
+    if isinstance(graph.ids, NameIndex):
+        order = graph.ids.order
+    else:
+        order = array.array('i', sorted(range(len(names)), key=lambda a: 
+                                            (names.get_bytes(a), a)))
+    sections = {'node_types': graph.node_types, 'name_offsets': names.offsets,
+                'name_data': names.data, 'name_order': order, 
+                'offsets': graph.offsets, 'targets': graph.targets, 
+                'edge_types': graph.edge_types, 'song_nodes': table.nodes, 
+                'song_hashes': table.hashes, 
+                'song_edge_offsets': table.edge_offsets, 
+                'edge_nodes': table.edge_nodes, 'edge_codes': table.edge_codes}
+    views = {k: memoryview(v) for k, v in sections.items()}
+    header = {'settings': settings, 'source': source, 
+              'edge_names': graph.edge_names, 'sections': {}}
+    position = 0
+    for name, view in views.items():
+        header['sections'][name] = [position, view.format, view.nbytes]
+        position += get_padded(view.nbytes)
+    header = json.dumps(header).encode()
+    start = get_padded(len(SNAPSHOT_MAGIC) + 8 + len(header))
+    with open(f'{filename}.tmp', 'wb') as file:
+        file.write(SNAPSHOT_MAGIC)
+        file.write(array.array('q', [len(header)]))
+        file.write(header)
+        file.write(bytes(start - file.tell()))
+        for view in views.values():
+            file.write(view)
+            file.write(bytes(get_padded(view.nbytes) - view.nbytes))
+    os.replace(f'{filename}.tmp', filename)
+
+
+def read_snapshot(filename, settings):
+    """Returns snapshot with arrays that point into the memory mapped file or
+    None if file is missing, was written with different settings or is 
+    truncated or corrupt."""
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'rb') as file:
+            data = memoryview(mmap.mmap(file.fileno(), 0, 
+                                        access=mmap.ACCESS_READ))
+        return get_snapshot(data, settings)
+    except (ValueError, TypeError, KeyError, IndexError, AttributeError):
+        return None
+
+
+def get_snapshot(data, settings):
+    """Raises ValueError if sections don't fit into the data or don't agree 
+    with each other. Other exceptions are raised by malformed header."""
+    if bytes(data[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+        return None
+    position = len(SNAPSHOT_MAGIC)
+    length = data[position:position+8].cast('q')[0]
+    if not 0 <= length <= len(data) - position - 8:
+        raise ValueError('Header is truncated.')
+    header = json.loads(bytes(data[position+8:position+8+length]))
+    if header['settings'] != settings:
+        return None
+    start = get_padded(position + 8 + length)
+    a = {}
+    for name, (offset, a_format, size) in header['sections'].items():
+        if offset < 0 or size < 0 or start + offset + size > len(data):
+            raise ValueError(f'Section {name} is truncated.')
+        a[name] = data[start+offset:start+offset+size].cast(a_format)
+    check_sections(a)
+    names = Names(a['name_offsets'], a['name_data'])
+    ids = NameIndex(names, a['name_order'], a['node_types'])
+    graph = Graph(ids, names, a['node_types'], a['offsets'], a['targets'], 
+                  a['edge_types'], header['edge_names'])
+    table = SongTable(a['song_nodes'], a['song_hashes'], 
+                      a['song_edge_offsets'], a['edge_nodes'], a['edge_codes'])
+    return Snapshot(graph, table, header['source'])
+
+
+def check_sections(a):
+    """Checks that lengths of sections agree with each other."""
+    n_nodes, n_songs = len(a['node_types']), len(a['song_nodes'])
+    consistent = \
+        len(a['name_offsets']) == n_nodes + 1 and \
+        a['name_offsets'][-1] == len(a['name_data']) and \
+        len(a['name_order']) == n_nodes and \
+        len(a['offsets']) == n_nodes + 1 and \
+        a['offsets'][-1] == len(a['targets']) == len(a['edge_types']) and \
+        len(a['song_hashes']) == n_songs * HASH_SIZE and \
+        len(a['song_edge_offsets']) == n_songs + 1 and \
+        a['song_edge_offsets'][-1] == len(a['edge_nodes']) == \
+            len(a['edge_codes'])
+    if not consistent:
+        raise ValueError('Sections of snapshot are inconsistent.')
+
+
+def extend_array(an_array, values):
+    """Extends array with a slice of array or memoryview in bulk."""
+    an_array.frombytes(memoryview(values).cast('B'))
+
+
+def get_padded(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def get_settings_hash():
+    """Hash of script's source code, which includes all of the settings."""
+    with open(__file__, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def get_song_hash(song):
+    """Hash of song's representation, that also changes with order of its
+    attributes, because it determines order of edges."""
+    return hashlib.sha1(repr(song).encode()).digest()
 
 
 def remove_brackets(name):
@@ -124,6 +959,11 @@ def read_json_file(filename):
         return json.load(file)
 
 
+def write_json_file(filename, an_object):
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump(an_object, file, ensure_ascii=False, indent=2)
+
+
 def equals_ic(regex, text):
     return re.match(regex, text, flags=re.IGNORECASE)
 
@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 #
-# Usage: test.py 
+# Usage: jsonize.py [--jobs N] [--no-cache] [FILE]
 # Converts 'wiki_data.txt' that contains infobox fields of the songs to 
-# 'wiki_data.json' file.
-
+# 'wiki_data.json' file. With '--jobs N' the infoboxes are parsed by N
+# processes. Parsed infoboxes are cached in 'wiki_data_cache.json' by the hash
+# of their text and parser settings, so only new or edited ones get parsed.
+
+import argparse
+import collections
+import concurrent.futures
+import filecmp
+import hashlib
 import sys
 import re
 import json
@@ -11,6 +18,7 @@ import os
 
 WIKI_FILE = '../data/wiki_data.txt'
 JSON_FILE = '../data/wiki_data.json'
+CACHE_FILE = '../data/wiki_data_cache.json'
 SAVE = True
 
 TOKENIZE = ['genre', 'writer', 'producer', 'label']
@@ -21,22 +29,200 @@ IGNORE = ['border']
 FIX_LABEL = False
 REMOVE_COUNTRY_FROM_LABEL = False
 
+IN_FLIGHT_PER_JOB = 4
+BLOCK_SIZE = 2**16
+TOKEN_RE = re.compile('{{|}}|\[\[')
+
+# (pattern, replacement) pairs that are applied one after another.
+CLEANUP_PASSES = [(re.compile('<br.*?>'), ', '),
+                  (re.compile('<ref.*?>.*?</ref>', flags=re.DOTALL), ''),
+                  (re.compile('<ref.*?/>', flags=re.DOTALL), ''),
+                  (re.compile('</*div.*?>', flags=re.DOTALL), ''),
+                  (re.compile('<!--.*?-->'), ''),
+                  (re.compile('</*small>', flags=re.IGNORECASE), '')]
+
+KEYS = {'A': 1, 'B': 3, 'C': 4, 'D': 6, 'E': 8, 'F': 9, 'G': 11}
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 
+          'august', 'september', 'october', 'november', 'december']
+MONTH_RE = re.compile('|'.join(MONTHS), flags=re.IGNORECASE)
+FIRST_DATE_RE = re.compile('\d{4}\.\d+\.\d+|\d{4}\.\d+|'
+                           '\w+ \d+, \d{4}|\w+, \d{4}|'
+                           '\d+ \w+ \d{4}|\d+\. \w+ \d{4}|\w+ \d{4}|\d{4}')
+
 
 def main():
-    if len(sys.argv) > 1:
-        objects = [get_object(sys.argv[1])]
+    args = get_args()
+    if args.file:
+        objects = [get_object(args.file)]
     else:
-        objects = [get_object_text(a) for a in expand_single_file(WIKI_FILE)]
+        cache_file = None if args.no_cache else CACHE_FILE
+        objects = get_wiki_objects(WIKI_FILE, args.jobs, cache_file)
 
-    out = {get_name(obj): obj for obj in objects}
-    print(json.dumps(out, ensure_ascii=False, indent=2))
+    parts = get_json_parts(objects)
     if SAVE:
-        write_json(JSON_FILE, out)
+        write_json_parts(JSON_FILE, parts, echo=True)
+    else:
+        print(''.join(parts), end='')
+    print()
+
+
+def jsonize(wiki_file=WIKI_FILE, json_file=JSON_FILE, jobs=1, 
+            cache_file=CACHE_FILE):
+    """Converts 'wiki_file' to 'json_file' and returns the songs dict. Cache is
+    not used if 'cache_file' is None. Json file is only replaced if its 
+    contents changed."""
+    songs = {}
+    objects = get_wiki_objects(wiki_file, jobs, cache_file)
+    write_json_parts(json_file, get_json_parts(collect_objects(objects, songs)))
+    return songs
+
+
+def write_json_parts(json_file, parts, echo=False):
+    """Writes parts to a temporary file, that replaces the 'json_file' only 
+    after all parts were written and only if contents changed. With 'echo' 
+    parts also get printed."""
+    temp_file = f'{json_file}.tmp'
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            for part in parts:
+                if echo:
+                    print(part, end='')
+                file.write(part)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+    if os.path.isfile(json_file) and filecmp.cmp(temp_file, json_file, 
+                                                 shallow=False):
+        os.remove(temp_file)
+    else:
+        os.replace(temp_file, json_file)
+
+
+def get_wiki_objects(wiki_file, jobs, cache_file):
+    chunks = read_chunks(wiki_file)
+    if not cache_file:
+        return get_objects(chunks, jobs)
+    return get_objects_cached(chunks, jobs, cache_file)
+
+
+def collect_objects(objects, out):
+    for obj in objects:
+        out[get_name(obj)] = obj
+        yield obj
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Converts infoboxes to JSON.')
+    parser.add_argument('file', nargs='?', help='parse single infobox file')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help='number of parsing processes')
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f"don't read or write '{CACHE_FILE}'")
+    return parser.parse_args()
+
+
+def get_objects(chunks, jobs):
+    keyed_chunks = ((None, a) for a in chunks)
+    return (obj for _, obj in get_keyed_objects(keyed_chunks, jobs, {}))
+
+
+def get_objects_cached(chunks, jobs, cache_file):
+    """Parses only chunks that are not in the cache and rewrites the cache with
+    objects of current chunks, so deleted chunks get evicted."""
+    cache = read_cache(cache_file)
+    settings = get_settings_hash()
+    keyed_chunks = ((get_chunk_hash(a, settings), a) for a in chunks)
+    new_cache = {}
+    for key, obj in get_keyed_objects(keyed_chunks, jobs, cache):
+        new_cache[key] = obj
+        yield obj
+    write_json(cache_file, new_cache, indent=None)
+
+
+def get_keyed_objects(keyed_chunks, jobs, cache):
+    if jobs > 1:
+        return get_keyed_objects_parallel(keyed_chunks, jobs, cache)
+    return ((k, cache[k] if k in cache else get_object_text(a)) 
+            for k, a in keyed_chunks)
+
+
+def get_settings_hash():
+    """Hash of parser's source code, which includes all of the settings."""
+    with open(__file__, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def get_chunk_hash(chunk, settings):
+    return hashlib.sha1(f'{settings}{chunk}'.encode()).hexdigest()
+
+
+def read_cache(filename):
+    if not os.path.isfile(filename):
+        return {}
+    try:
+        with open(filename, encoding='utf-8') as file:
+            return json.load(file)
+    except ValueError:
+        return {}
 
 
-def expand_single_file(filename):
-    text = ''.join(read_file(filename))
-    return text.split('####')
+def get_keyed_objects_parallel(keyed_chunks, jobs, cache):
+    """Parses chunks in a process pool and yields objects in source order.
+    At most 'IN_FLIGHT_PER_JOB' chunks per process are submitted at once."""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = collections.deque()
+        for key, chunk in keyed_chunks:
+            if len(futures) >= jobs * IN_FLIGHT_PER_JOB:
+                yield get_keyed_result(futures.popleft())
+            if key in cache:
+                future = concurrent.futures.Future()
+                future.set_result(cache[key])
+            else:
+                future = executor.submit(get_object_text, chunk)
+            futures.append((key, future))
+        while futures:
+            yield get_keyed_result(futures.popleft())
+
+
+def get_keyed_result(keyed_future):
+    key, future = keyed_future
+    return key, future.result()
+
+
+def read_chunks(filename):
+    """Yields text between '####' separators, reading file in blocks."""
+    SEPARATOR = '####'
+    buff = ''
+    with open(filename, encoding='utf-8') as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), ''):
+            i_search = max(0, len(buff) - len(SEPARATOR) + 1)
+            buff += block
+            i_start = 0
+            i_sep = buff.find(SEPARATOR, i_search)
+            while i_sep != -1:
+                yield buff[i_start:i_sep]
+                i_start = i_sep + len(SEPARATOR)
+                i_sep = buff.find(SEPARATOR, i_start)
+            buff = buff[i_start:]
+    yield buff
+
+
+def get_json_parts(objects):
+    """Yields 'json.dumps({name: obj, ...}, indent=2)' one object at a time."""
+    names = set()
+    sep = '{'
+    for obj in objects:
+        name = get_name(obj)
+        if name in names:
+            print(f'Duplicate name: {name}', file=sys.stderr)
+        names.add(name)
+        name = json.dumps(name, ensure_ascii=False)
+        value = json.dumps(obj, ensure_ascii=False, indent=2)
+        value = value.replace('\n', '\n  ')
+        yield f'{sep}\n  {name}: {value}'
+        sep = ','
+    yield '{}' if sep == '{' else '\n}'
+
 
 def get_name(obj):
     if 'Name' in obj:
@@ -54,6 +240,9 @@ def get_object(filename):
 def get_object_text(text):
     wiki_obj = cleanup(text)
     obj, _ = get_parts(wiki_obj, 0)
+    if isinstance(obj, dict):
+        add_release_date(obj)
+        add_key_and_length(obj)
     return obj
 
 
@@ -71,7 +260,7 @@ def get_parts(line, i_start):
     i = name_to+1
 
     while i <= len(line):
-        if re.match('{{', line[i:]):
+        if line.startswith('{{', i):
             i += 2
             parts, i = get_parts(line, i)
             if isinstance(parts, str):
@@ -81,19 +270,28 @@ def get_parts(line, i_start):
                     out.append(buff.strip())
                     buff = ''
                 out.append(parts)
-        if re.match('}}', line[i:]):
+        if line.startswith('}}', i):
             return tokenize(out, buff, i, name)
-        if re.match('\[\[', line[i:]):
+        if line.startswith('[[', i):
             link, i = get_link(line, i+2)
             buff += link
             continue
         if i >= len(line):
             return tokenize(out, buff, i, name)
-        buff += line[i]
-        i += 1
+        i_next = get_next_token(line, i+1)
+        buff += line[i:i_next]
+        i = i_next
     return out
 
 
+def get_next_token(line, i):
+    """Returns location of the next '{{', '}}' or '[[' or end of line."""
+    token = TOKEN_RE.search(line, i)
+    if not token:
+        return len(line)
+    return token.start()
+
+
 def tokenize(out, buff, i, name):
     name = name.strip()
     i = i + 2
@@ -232,45 +430,139 @@ def parse_youtube(value):
 
 
 ###
-##  CLEANUP
+##  RELEASE DATE
 #
 
-def cleanup(line):
-    line = nbsp(line)
-    line = remove_br(line)
-    line = remove_html_element(line, 'ref')
-    line = remove_html_mark(line, 'div')
-    line = remove_comment(line)
-    line = remove_formating(line)
-    return line
+def add_release_date(obj):
+    """Adds 'released_year', 'released_month' and 'released_day' numbers and
+    'released_sort' in the form of YYYYMMDD, where missing month and day are 
+    set to 6 and 15. Year and month are searched for in the whole field, day 
+    and sort value are taken from the first date. Missing values are None."""
+    released = get_first_str(obj.get('released'))
+    first_date = get_first_date(released)
+    year, month, day = parse_release_date(first_date) if first_date \
+                           else (None, None, None)
+    obj['released_year'] = get_year(released)
+    obj['released_month'] = get_month(released)
+    obj['released_day'] = day
+    obj['released_sort'] = None
+    if year and month != 0:
+        obj['released_sort'] = year*10000 + (month or 6)*100 + (day or 15)
+
+
+def get_first_date(released):
+    """
+    1956.01.27
+    1967.1.1
+    1969.03
+    
+    September 25, 1967
+    April, 1962
+
+    30 June 1997
+    8. february 1980
+    March 1974
+    1974
+    """
+    match = FIRST_DATE_RE.match(released)
+    if match:
+        return match.group()
+
+
+def parse_release_date(date):
+    """Returns (year, month, day) of the date returned by 'get_first_date()'.
+    Month is 0 if month's name can't be recognized."""
+    if re.match('\d{4}\.\d+', date):
+        tokens = [int(a) if a.isnumeric() else None for a in date.split('.')]
+        return tuple(tokens + [None, None])[:3]
+    if ',' in date:
+        month, year = [a.strip() for a in date.split(',')]
+        month, _, day = month.partition(' ')
+        return int(year), get_month_from_word(month), int(day) if day else None
+    tokens = date.split()
+    if len(tokens) == 1:
+        return int(tokens[0]), None, None
+    if len(tokens) == 2:
+        return int(tokens[1]), get_month_from_word(tokens[0]), None
+    return int(tokens[2]), get_month_from_word(tokens[1]), \
+           int(tokens[0].strip('.'))
+
+
+def get_month_from_word(word):
+    month = MONTH_RE.search(word)
+    if not month:
+        return 0
+    return MONTHS.index(month.group().lower()) + 1
+
+
+def get_year(release):
+    year = re.search('\d{4}', release)
+    if year:
+        return int(year.group())
+
+
+def get_month(release):
+    if re.search('[a-zA-Z]', release):
+        month = MONTH_RE.search(release)
+        if month:
+            return MONTHS.index(month.group().lower()) + 1
+    if '.' in release:
+        digit_month = re.match('\d+', release.split('.')[1])
+        if digit_month:
+            return int(digit_month.group())
 
 
-def nbsp(line):
-    return re.sub('&nbsp;', ' ', line)
+###
+##  KEY AND LENGTH
+#
 
+def add_key_and_length(obj):
+    """Adds 'key_index', that goes from 1 for A to 12 for G#, and 
+    'length_seconds' of the first length. Missing values are None."""
+    obj['key_index'] = get_key_index(get_first_str(obj.get('key')))
+    obj['length_seconds'] = get_seconds(get_first_str(obj.get('length')))
 
-def remove_html_element(line, id):
-    line = re.sub(f'<{id}.*?>.*?</{id}>', '', line, flags=re.DOTALL)
-    return re.sub(f'<{id}.*?/>', '', line, flags=re.DOTALL)
 
+def get_key_index(key):
+    out = KEYS.get(key[:1].upper())
+    if out is None:
+        return
+    if key[1:2] == 'b':
+        return (out - 2) % 12 + 1
+    if key[1:2] == '#':
+        return out % 12 + 1
+    return out
 
-def remove_html_mark(line, id):
-    return re.sub(f'</*{id}.*?>', '', line, flags=re.DOTALL)
 
+def get_seconds(length):
+    match = re.match('(\d+):(\d+)', length)
+    if match:
+        return int(match.group(1))*60 + int(match.group(2))
 
-def remove_comment(line):
-    return re.sub('<!--.*?-->', '', line)
 
+def get_first_str(value):
+    """Returns stripped value or its first value if it is a list. Returns empty
+    string if value is missing or not a string."""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if not isinstance(value, str):
+        return ''
+    return value.strip()
 
-def remove_formating(line):
-    FORMATINGS = ['small']
-    for a_format in FORMATINGS:
-        line = re.sub(f'</*{a_format}>', '', line, flags=re.IGNORECASE)
-    return line
 
+###
+##  CLEANUP
+#
 
-def remove_br(line):
-    return re.sub('<br.*?>', ', ', line)
+def cleanup(line):
+    """Replaces '&nbsp;' and '<br>' and removes refs, divs, comments and small
+    marks. Patterns are applied in separate passes, because each of them 
+    starts with a literal that regex engine can quickly search for, which an 
+    alternation of them can't."""
+    line = line.replace('&nbsp;', ' ')
+    for pattern, replacement in CLEANUP_PASSES:
+        line = pattern.sub(replacement, line)
+    return line
 
 
 ###
@@ -282,16 +574,16 @@ def read_file(filename):
         return file.readlines()
        
 
-def write_json(filename, an_object):         
+def write_json(filename, an_object, indent=2):
     with open(filename, 'w', encoding='utf-8') as file:
-        json.dump(an_object, file, ensure_ascii=False, indent=2)
+        json.dump(an_object, file, ensure_ascii=False, indent=indent)
    
 
 def get_location(line, i, regex):
-    loc = re.search(regex, line[i:], re.MULTILINE)
+    loc = re.compile(regex, re.MULTILINE).search(line, i)
     if not loc:
         return
-    return i + loc.span()[0]
+    return loc.start()
 
  
 def equals_ic(regex, text):
@@ -1,70 +1,182 @@
 #!/usr/bin/env python3
 #
-# Usage: plot.py 
+# Usage: plot.py [--jobs N] [--no-cache] [--format {png,svg}]
 # Creates different plots from data in 'wiki_data.json' and saves them in
-# 'img' dir.
-
+# 'img' dir. Function 'plot()' does the same for already loaded data. 
+# Each plot is drawn in a separate process of a pool with its own Matplotlib
+# settings. Plot is only drawn if fingerprint of its values and settings
+# differs from the one in 'plot_cache.json' or if its image is missing.
+# With '--format svg' plots are drawn as SVG with standard library only.
+# Songs are parsed once into NumPy columns that all plots read from. 
+# Matplotlib is only imported by functions that draw.
+
+import argparse
+import concurrent.futures
+import hashlib
+import html
+import importlib.metadata
+import io
 import json
+import math
+import os
 import re
-import matplotlib.pyplot as plt
-from collections import Counter
-import numbers
+import sys
 import calendar
 import collections
 
+import numpy as np
+
 
 JSON_FILE = '../data/wiki_data.json'
 LIST_OF_SONGS = '../list_of_songs.txt'
 IMG_DIR = '../data/img'
+CACHE_FILE = '../data/plot_cache.json'
 
 DEBUG = False
 PRINT_ORIGINS = False
 GENERATE_STACKED_BARPLOT = False
 NORMALIZE_BPM = True
 BPM_WINDOW = 2
+# Songs released before the first edge are counted in the first decade and 
+# after the last one in the last decade.
+DECADE_EDGES = [1964, 1974, 1984, 1994]
+DECADE_LABELS = ["'54-'63", "'64-'73", "'74-'83", "'84-'93", "'94-'04"]
+# ORIGIN_COLORS = {'England': '#b5ffb9', 'International': '#323fb9', 
+ORIGIN_COLORS = {'England': '#b5ffb9', 'International': '#500c3f', 
+                 'West Coast': '#23453f', 'East Coast': '#ffffb9', 
+                 'Central United States': '#992233'}
 
 
-MONTHS = {'january': 1,
-          'february': 2,
-          'march': 3,
-          'april': 4,
-          'may' : 5,
-          'june': 6,
-          'july': 7,
-          'august': 8,
-          'september': 9,
-          'october': 10,
-          'november': 11,
-          'december': 12}
-
-MONTHS_RE = 'january|february|march|april|may|june|july|august|september|octo' \
-            'ber|november|december'
-
-KEYS = {'A': 1, 'B': 3, 'C': 4, 'D': 6, 'E': 8, 'F': 9, 'G': 11}
 INV_KEYS = ['A', 'A#', 'B', 'C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#']
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Generates plots.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        metavar='N', help='number of drawing processes')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='draw all plots')
+    parser.add_argument('--format', choices=['png', 'svg'], default='png',
+                        help='format of images')
+    args = parser.parse_args()
     songs = read_json_file(JSON_FILE)
     list_of_songs = get_file_contents(LIST_OF_SONGS)
     list_of_songs = get_list_of_songs(list_of_songs)
+    cache_file = None if args.no_cache else CACHE_FILE
+    plot(songs, list_of_songs, jobs=args.jobs, cache_file=cache_file, 
+         img_format=args.format)
+
+
+def plot(songs, list_of_songs, img_dir=IMG_DIR, jobs=1, cache_file=CACHE_FILE,
+         img_format='png'):
+    """Saves plots of songs whose names are in 'list_of_songs' into 'img_dir'
+    as 'png' or 'svg' images. Plots are drawn by a pool of 'jobs' processes. 
+    Plots whose fingerprint matches the one in 'cache_file' are skipped. Cache
+    is not used if 'cache_file' is None."""
     songs = {k: v for k, v in songs.items() if k in list_of_songs} 
     if PRINT_ORIGINS:
         print_origins(songs)
-    generate_plot(songs, 'released', get_year, 'years', get_year_xlabel, 
-        ticks_filter=every_even, font_size_in=18)
-    generate_plot(songs, 'released', get_month, 'months')
-    generate_plot(songs, 'length', get_minutes, 'minutes')
-    generate_plot(songs, 'bpm', get_bpm, 'bpm', get_bpm_xlabel, font_size_in=14)
-    generate_plot(songs, 'key', get_key, 'key', get_key_xlabel, font_size_in=20)
-    generate_piechart(songs, 'origin')
+    charts = get_charts(get_dataset(songs), img_dir)
+    if img_format == 'svg':
+        charts = [(SVG_FUNCTIONS[function], kwargs) 
+                      for function, kwargs in charts]
+    cache = read_cache(cache_file) if cache_file else {}
+    fingerprints = {f"{a[1]['filename']}.{img_format}": 
+                        get_fingerprint(*a, img_format) for a in charts}
+    charts = [a for a in charts 
+                  if not is_cached(cache, fingerprints, img_format, *a)]
+    if charts:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as \
+                executor:
+            futures = {f"{a[1]['filename']}.{img_format}": 
+                           executor.submit(draw_chart, *a) for a in charts}
+            for filename, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f'Cannot draw plot {filename}: {e!r}', 
+                          file=sys.stderr)
+                    del fingerprints[filename]
+    # Fingerprints of charts in other formats are kept.
+    new_cache = {**cache, **fingerprints}
+    if cache_file and new_cache != cache:
+        write_if_changed(cache_file, json.dumps(new_cache, indent=2).encode())
+
+
+def get_charts(dataset, img_dir):
+    """Returns list of (function, kwargs) pairs, one for each chart. Values
+    are binned beforehand, so that songs don't get sent to processes. Charts
+    without any values are left out."""
+    out = [
+        get_plot_chart(dataset.year, 'years', get_year_xlabel,
+            ticks_filter=every_even, font_size_in=18, img_dir=img_dir),
+        get_plot_chart(dataset.month, 'months', img_dir=img_dir),
+        get_plot_chart(dataset.length, 'minutes', binner=get_minutes, 
+            img_dir=img_dir),
+        get_plot_chart(dataset.bpm, 'bpm', get_bpm_xlabel,
+            binner=get_bpm_windows, font_size_in=14, img_dir=img_dir),
+        get_plot_chart(dataset.key, 'key', get_key_xlabel, font_size_in=20,
+            img_dir=img_dir),
+        get_piechart_chart(dataset, 'origin', img_dir=img_dir)
+    ]
     if GENERATE_STACKED_BARPLOT:
-        generate_stacked_barplot(songs, 'origin stacked barplot')
+        out.append((generate_stacked_barplot, 
+                    {'origin_dict': get_origin_dict(dataset), 
+                     'filename': 'origin stacked barplot', 
+                     'img_dir': img_dir}))
+    return [a for a in out if a]
+
+
+def draw_chart(function, kwargs):
+    function(**kwargs)
+
+
+def is_cached(cache, fingerprints, img_format, function, kwargs):
+    filename = f"{kwargs['filename']}.{img_format}"
+    return cache.get(filename) == fingerprints[filename] and \
+           os.path.isfile(f"{kwargs['img_dir']}/{filename}")
+
+
+def get_fingerprint(function, kwargs, img_format):
+    """Hash of chart's function, values and settings. Settings also include
+    module's source code and Matplotlib's version if chart is drawn by it.
+    Image dir is left out, so it can be given relative to any working dir."""
+    kwargs = {k: v for k, v in kwargs.items() if k != 'img_dir'}
+    settings = {'function': function, 'kwargs': kwargs,
+                'source': get_source_hash()}
+    if img_format == 'png':
+        settings['matplotlib'] = get_package_version('matplotlib')
+    text = json.dumps(settings, sort_keys=True, default=get_qualname)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def get_source_hash():
+    with open(__file__, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def get_package_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def get_qualname(function):
+    return function.__qualname__
 
 
-def generate_piechart(songs, key):
-    values = parse_releases(songs, key, parser=lambda x: x)
-    generate_origin_piechart(Counter(values), filename=key)
+def get_piechart_chart(dataset, filename, img_dir=IMG_DIR):
+    """Chart of origins ordered by name or None if there are no origins."""
+    column = dataset.origin
+    counts = np.bincount(column.values[column.valid], 
+                         minlength=len(dataset.origins))
+    origins = {dataset.origins[i]: int(counts[i]) for i in 
+                   np.argsort(dataset.origins) if counts[i]}
+    if not origins:
+        return None
+    return generate_origin_piechart, {'origins': origins, 
+                                      'filename': filename, 'img_dir': img_dir}
 
 
 def print_origins(songs):
@@ -75,14 +187,23 @@ def print_origins(songs):
         print(song, a['origin'], sep=' - ')
 
 
-def generate_plot(songs, key, parser, xlabel, label_parser=None, 
-                  ticks_filter=None, font_size_in=None):
-    values = parse_releases(songs, key, parser)
-    values = [int(a) for a in values]
-    generate_release_dates_chart(values, filename=xlabel,
-                                 ticks_filter=ticks_filter, 
-                                 label_parser=label_parser,
-                                 font_size_in=font_size_in)
+def get_plot_chart(column, xlabel, label_parser=None, ticks_filter=None, 
+                   font_size_in=None, binner=None, img_dir=IMG_DIR):
+    """Chart of counts of column's values or None if it has no valid values. 
+    Optional 'binner' maps an array of values to bins."""
+    values = column.values[column.valid]
+    if not len(values):
+        return None
+    if binner:
+        values = binner(values)
+    first, counts = get_histogram(values)
+    return generate_release_dates_chart, {'first': first, 
+                                          'counts': counts.tolist(),
+                                          'filename': xlabel,
+                                          'ticks_filter': ticks_filter,
+                                          'label_parser': label_parser,
+                                          'font_size_in': font_size_in,
+                                          'img_dir': img_dir}
 
 
 def get_year_xlabel(value):
@@ -90,193 +211,394 @@ def get_year_xlabel(value):
     return f"'{value}"
 
 
-def get_bpm(value):
-    bpm = int(value)
+def get_bpm_windows(bpms):
+    """Returns indices of BPM windows for an array of BPMs."""
     if NORMALIZE_BPM:
-        if bpm > 140:
-            bpm = int(bpm/2)
-        if bpm < 70:
-            bpm = int(bpm*2)
-    out = bpm // BPM_WINDOW
-    return out  
+        bpms = np.where(bpms > 140, bpms // 2, bpms)
+        bpms = np.where(bpms < 70, bpms * 2, bpms)
+    return bpms // BPM_WINDOW
 
 
 def get_bpm_xlabel(value):
     return str(int(value*BPM_WINDOW))
 
 
-def get_key(value):
-    if value == 'Ab':
-        return 12
-    out = KEYS[value[0]]
-    if 'b' in value:
-        return out - 1
-    if '#' in value:
-        return out + 1
-    return out
+def get_minutes(seconds):
+    return seconds // 60
 
 
 def get_key_xlabel(value):
     return INV_KEYS[value-1]
 
 
-def parse_releases(songs, key, parser):
-    out = []
-    for song in songs.values():
-        if key not in song:
-            continue
-        value = song[key]
-        if len(value) < 1:
+###
+##  DATASET
+#
+
+# Column's values are only meaningful where 'valid' is True.
+Column = collections.namedtuple('Column', 'values valid')
+Dataset = collections.namedtuple('Dataset', 'year month length bpm key origin '
+                                            'origins')
+
+
+def get_dataset(songs):
+    """Parses songs into columns, so that plots and statistics only need to 
+    read arrays. Origins are coded by their index in the 'origins' list."""
+    origins = list(dict.fromkeys(a for a in (get_value(song, 'origin') 
+                                     for song in songs.values()) if a))
+    codes = {a: i for i, a in enumerate(origins)}
+    return Dataset(year=get_column(songs, 'released_year', int), 
+                   month=get_column(songs, 'released_month', int),
+                   length=get_column(songs, 'length_seconds', int),
+                   bpm=get_column(songs, 'bpm', int),
+                   key=get_column(songs, 'key_index', int),
+                   origin=get_column(songs, 'origin', codes.get),
+                   origins=origins)
+
+
+def get_column(songs, key, parser):
+    """Parses values of key. Missing and unparsable values are not valid."""
+    values = np.zeros(len(songs), dtype=np.int64)
+    valid = np.zeros(len(songs), dtype=bool)
+    for i, song in enumerate(songs.values()):
+        value = get_value(song, key)
+        if value is None:
             continue
-        if isinstance(value, list):
-            value = value[0]
         parsed_value = parser(value)
-        if parsed_value:
-            out.append(parsed_value)
-        elif DEBUG:
-            print(value)
-    return sorted(out)
-
+        if parsed_value is None:
+            if DEBUG:
+                print(value)
+            continue
+        values[i] = parsed_value
+        valid[i] = True
+    return Column(values, valid)
 
-def get_year(release):
-    if type(release) == list:
-        release = release[0]
-    year = re.search('\d{4}', release)
-    if year:
-        return int(year.group())
 
+def get_value(song, key):
+    """Returns value of key or its first value if it is a list. Returns None 
+    if value is missing or empty."""
+    value = song.get(key)
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if value is None or isinstance(value, str) and not value:
+        return None
+    return value
 
-def get_month(release):
-    if re.search('[a-zA-Z]', release):
-        month = re.search(MONTHS_RE, release, flags=re.IGNORECASE)
-        if month:
-            month = month.group()
-            return MONTHS[month.lower()]
-    return get_numeric_month(release)
 
+###
+##  HISTOGRAM
+#
 
-def get_numeric_month(release):
-    if re.search('\.', release):
-        tokens = release.split('.')
-        digit_month = re.match('\d+', tokens[1])
-        if digit_month:
-            return int(digit_month.group())
+def get_histogram(values):
+    """Returns the lowest of integer values and an array with counts of every
+    integer from the lowest to the highest value."""
+    first = int(values.min())
+    return first, np.bincount(values - first)
 
 
-def get_minutes(length):
-    if ':' in length:
-        return int(length.split(':')[0])
+def get_matrix(rows, columns, n_rows, n_columns):
+    """Returns matrix with counts of (row, column) pairs."""
+    counts = np.bincount(rows * n_columns + columns, 
+                         minlength=n_rows * n_columns)
+    return counts.reshape(n_rows, n_columns)
 
 
 ###
 ##  PLOT
 #
 
-def generate_release_dates_chart(listOfYears, filename=None, ticks_filter=None,
-        label_parser=None, font_size_in=None):
+def generate_release_dates_chart(first, counts, filename=None, 
+        ticks_filter=None, label_parser=None, font_size_in=None, 
+        img_dir=IMG_DIR):
+    """Draws bar chart of 'counts' of consecutive values starting with 
+    'first'."""
+    import matplotlib.pyplot as plt
     font_size = 22
     width = 22
     if font_size_in:
         font_size = font_size_in
-    set_plt_size(plt, width=width, height=8, font_size=font_size)
-    albumsPerYear = getAlbumsPerYear(listOfYears)
-    yearRange = getYearRange(listOfYears)
-    y = albumsPerYear
-    x = yearRange
-    x_ticks = [listOfYears[0]-1] + yearRange + [listOfYears[-1]+1]
+    with plt.rc_context(get_rc(width=width, height=8, font_size=font_size)):
+        draw_release_dates_chart(plt, first, counts, filename, ticks_filter, 
+                                 label_parser, img_dir)
+
+
+def draw_release_dates_chart(plt, first, counts, filename, ticks_filter, 
+                             label_parser, img_dir):
+    x, x_ticks, tick_labels, label = get_bar_layout(first, counts, filename,
+                                                    ticks_filter, label_parser)
+    if tick_labels is None:
+        plt.xticks(x_ticks)
+    else:
+        plt.xticks(x_ticks, tick_labels)
+    if label:
+        plt.xlabel(label)
+    plt.bar(x, counts, color="blue")
+    present_plt(plt, filename, img_dir)
+
+
+def get_bar_layout(first, counts, filename, ticks_filter, label_parser):
+    """Returns x values of bars, x ticks, their labels or None if ticks should
+    be used as labels, and label of x axis."""
+    yearRange = list(range(first, first + len(counts)))
+    x_ticks = [first-1] + yearRange + [yearRange[-1]+1]
     if filename == 'key':
         x_ticks = yearRange
     if ticks_filter:
         x_ticks = ticks_filter(x_ticks)
-    
+    tick_labels = None
     if filename == 'months':
-        plt.xticks(x_ticks, calendar.month_abbr)
+        tick_labels = list(calendar.month_abbr) + ['']
     elif label_parser:
-        plt.xticks(x_ticks, [label_parser(a) for a in x_ticks])
-    else:
-        plt.xticks(x_ticks)
-
+        tick_labels = [label_parser(a) for a in x_ticks]
+    label = None
     if filename:
         label = filename[:-1] if filename not in ['minutes', 'bpm', 'key'] \
                     else filename
         label = label.capitalize()
         if filename == 'bpm':
             label = 'BPM'
-        plt.xlabel(label)
-    plt.bar(x, y, color="blue")
-    present_plt(plt, filename)
+    return yearRange, x_ticks, tick_labels, label
 
 
-def generate_origin_piechart(origins, filename=None):
-    set_plt_size(plt, width=22, height=10, font_size=24)
-    labels = origins.keys()
-    sizes = [origins[a]/len(origins) for a in labels]
-    fig1, ax1 = plt.subplots()
-    ax1.pie(sizes, labels=labels, autopct='%1.1f%%',
-            shadow=True, startangle=90)
-    ax1.axis('equal')
-    present_plt(plt, filename)
+def generate_origin_piechart(origins, filename=None, img_dir=IMG_DIR):
+    import matplotlib.pyplot as plt
+    with plt.rc_context(get_rc(width=22, height=10, font_size=24)):
+        labels = origins.keys()
+        sizes = [origins[a]/len(origins) for a in labels]
+        fig1, ax1 = plt.subplots()
+        ax1.pie(sizes, labels=labels, autopct='%1.1f%%',
+                shadow=True, startangle=90)
+        ax1.axis('equal')
+        present_plt(plt, filename, img_dir)
 
 
-def generate_stacked_barplot(songs, filename=None):
+def generate_stacked_barplot(origin_dict, filename=None, img_dir=IMG_DIR):
     # origin_dict[origin][decade] = %
-    origin_dict = get_origin_dict(songs)
+    import matplotlib.pyplot as plt
+    with plt.rc_context(get_rc(width=22, height=10, font_size=22)):
+        draw_stacked_barplot(plt, origin_dict, filename, img_dir)
+
 
-    set_plt_size(plt, width=22, height=10, font_size=22)
+def draw_stacked_barplot(plt, origin_dict, filename, img_dir):
     r = list(range(len(origin_dict)))
-    # colors = {'England': '#b5ffb9', 'International': '#323fb9', 
-    colors = {'England': '#b5ffb9', 'International': '#500c3f', 
-              'West Coast': '#23453f', 'East Coast': '#ffffb9', 
-              'Central United States': '#992233'}
     bottom = [0] * len(origin_dict)
-    plt.xticks(r, ["'54-'63", "'64-'73", "'74-'83", "'84-'93", "'94-'04"])
+    plt.xticks(r, DECADE_LABELS)
 
     for origin in origin_dict:
-        color = colors[origin]
+        color = ORIGIN_COLORS[origin]
         plt.bar(r, origin_dict[origin], bottom=bottom, color=color)
         bottom = [a+b for a, b in zip(bottom, origin_dict[origin])]
 
-    present_plt(plt, filename)
+    present_plt(plt, filename, img_dir)
 
 
-def get_origin_dict(songs):
+def get_origin_dict(dataset):
     # Returns out[origin][decade] = %
-    out = {}
-    a_sum = Counter()
-    for song in songs.values():
-        if 'origin' not in song or 'released' not in song:
-            continue
-        year = get_year(song['released'])
-        origin = song['origin']
-        decade = min(4, (year - 1954)//10)
-        decades = out.get(origin, [0]*5)
-        decades[decade] += 1
-        out[origin] = decades
-        a_sum[decade] += 1
-    
-    for origin in out:
-        for i in range(len(out[origin])):
-            out[origin][i] /= a_sum[i]
-
-    return out
-
-
-def set_plt_size(plt, width, height, font_size):
-    fig_size = plt.rcParams["figure.figsize"]
-    fig_size[0] = width
-    fig_size[1] = height
-    plt.rcParams["figure.figsize"] = fig_size
-    plt.rcParams.update({'font.size': font_size})
-
-
-def present_plt(plt, filename):
+    valid = dataset.origin.valid & dataset.year.valid
+    rows = dataset.origin.values[valid]
+    decades = np.digitize(dataset.year.values[valid], DECADE_EDGES)
+    matrix = get_matrix(rows, decades, len(dataset.origins), 
+                        len(DECADE_EDGES)+1)
+    used = matrix.any(axis=1)
+    shares = matrix[used] / matrix.sum(axis=0)
+    origins = [a for a, is_used in zip(dataset.origins, used) if is_used]
+    return dict(zip(origins, shares.tolist()))
+
+
+def get_rc(width, height, font_size):
+    """Returns settings for 'plt.rc_context()', so that global ones stay
+    unchanged."""
+    return {'figure.figsize': [width, height], 'font.size': font_size}
+
+
+def present_plt(plt, filename, img_dir=IMG_DIR):
     if not filename:
         plt.show()
     else:
-        plt.savefig(f'{IMG_DIR}/{filename}', transparent=True)
+        image = io.BytesIO()
+        plt.savefig(image, format='png', transparent=True)
+        write_if_changed(f'{img_dir}/{filename}.png', image.getvalue())
     plt.close()
 
 
+###
+##  SVG
+#
+# Same charts as SVG. Sizes are in pixels of a figure with Matplotlib's 
+# default resolution and margins, so that they match the PNGs.
+
+SVG_DPI = 100
+# Left, bottom, right and top edge of axes as fractions of figure's size.
+AXES_BOX = (0.125, 0.11, 0.9, 0.88)
+BAR_WIDTH = 0.8
+MARGIN = 0.05
+TICK_LENGTH = 3.5
+TICK_PAD = 3.5
+LINE_WIDTH = 0.8
+N_Y_TICKS = 6
+PIE_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', 
+              '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+FONT = 'DejaVu Sans, Arial, sans-serif'
+
+
+def svg_release_dates_chart(first, counts, filename=None, ticks_filter=None, 
+        label_parser=None, font_size_in=None, img_dir=IMG_DIR):
+    x, x_ticks, tick_labels, label = get_bar_layout(first, counts, filename,
+                                                    ticks_filter, label_parser)
+    if tick_labels is None:
+        tick_labels = [str(a) for a in x_ticks]
+    bars = [(a, 0, b, 'blue') for a, b in zip(x, counts)]
+    out = get_svg_bars(22, 8, font_size_in or 22, bars, 
+                       list(zip(x_ticks, tick_labels)), label)
+    write_svg(filename, img_dir, out)
+
+
+def svg_stacked_barplot(origin_dict, filename=None, img_dir=IMG_DIR):
+    r = list(range(len(origin_dict)))
+    bottom = [0] * len(origin_dict)
+    bars = []
+    for origin, values in origin_dict.items():
+        bars.extend((x, b, v, ORIGIN_COLORS[origin]) 
+                        for x, b, v in zip(r, bottom, values))
+        bottom = [a+b for a, b in zip(bottom, values)]
+    out = get_svg_bars(22, 10, 22, bars, list(zip(r, DECADE_LABELS)), None)
+    write_svg(filename, img_dir, out)
+
+
+def svg_origin_piechart(origins, filename=None, img_dir=IMG_DIR):
+    """Pie starts at the top and goes counterclockwise, like Matplotlib's with
+    'startangle=90'."""
+    width, height, font_size = 22*SVG_DPI, 10*SVG_DPI, get_px(24)
+    left, top, right, bottom = get_axes_box(width, height)
+    cx, cy = (left+right) / 2, (top+bottom) / 2
+    radius = (bottom-top) / 2 / 1.25
+    total = sum(origins.values())
+    out, texts = [], []
+    angle = 90
+    for i, (name, count) in enumerate(origins.items()):
+        share = count / total
+        end = angle + share * 360
+        color = PIE_COLORS[i % len(PIE_COLORS)]
+        out.append(get_svg_wedge(cx, cy, radius, angle, end, color))
+        middle = math.radians((angle+end) / 2)
+        dx, dy = math.cos(middle), -math.sin(middle)
+        anchor = 'start' if dx >= 0 else 'end'
+        texts.append(get_svg_text(cx + 1.1*radius*dx, cy + 1.1*radius*dy, 
+                                  name, anchor, 'middle'))
+        texts.append(get_svg_text(cx + 0.6*radius*dx, cy + 0.6*radius*dy, 
+                                  f'{share*100:.1f}%', 'middle', 'middle'))
+        angle = end
+    write_svg(filename, img_dir, get_svg(width, height, font_size, 
+                                         out + texts))
+
+
+def get_svg_bars(width_in, height_in, font_size, bars, x_ticks, label):
+    """Returns SVG elements of bar chart. Bars are (x, bottom, height, color)
+    tuples and ticks (x, label) pairs."""
+    width, height, font_size = width_in*SVG_DPI, height_in*SVG_DPI, \
+                               get_px(font_size)
+    left, top, right, bottom = get_axes_box(width, height)
+    x_min = min(a[0] for a in bars) - BAR_WIDTH/2
+    x_max = max(a[0] for a in bars) + BAR_WIDTH/2
+    x_pad = (x_max - x_min) * MARGIN
+    x_min, x_max = x_min - x_pad, x_max + x_pad
+    y_max = max(a[1] + a[2] for a in bars) * (1 + MARGIN)
+    get_x = lambda a: left + (a-x_min) / (x_max-x_min) * (right-left)
+    get_y = lambda a: bottom - a / y_max * (bottom-top)
+    bar_width = BAR_WIDTH / (x_max-x_min) * (right-left)
+    colors = collections.defaultdict(list)
+    for x, y, value, color in bars:
+        if not value:
+            continue
+        colors[color].append(f'<rect x="{get_num(get_x(x) - bar_width/2)}" '
+                             f'y="{get_num(get_y(y+value))}" '
+                             f'width="{get_num(bar_width)}" '
+                             f'height="{get_num(get_y(y) - get_y(y+value))}"/>')
+    out = [f'<g fill="{a}">{"".join(b)}</g>' for a, b in colors.items()]
+    tick, pad = get_px(TICK_LENGTH), get_px(TICK_PAD)
+    ticks, texts = [], []
+    for x, text in x_ticks:
+        if not x_min <= x <= x_max:
+            continue
+        ticks.append(f'M{get_num(get_x(x))} {get_num(bottom)}v{get_num(tick)}')
+        texts.append(get_svg_text(get_x(x), bottom + tick + pad, text, 
+                                  'middle', 'hanging'))
+    for y in get_y_ticks(y_max):
+        ticks.append(f'M{get_num(left)} {get_num(get_y(y))}h{get_num(-tick)}')
+        texts.append(get_svg_text(left - tick - pad, get_y(y), f'{y:g}', 
+                                  'end', 'middle'))
+    if label:
+        texts.append(get_svg_text((left+right) / 2, 
+                                  bottom + tick + 2*pad + 1.2*font_size, 
+                                  label, 'middle', 'hanging'))
+    out.append(f'<path d="{"".join(ticks)}" stroke="black" '
+               f'stroke-width="{get_num(get_px(LINE_WIDTH))}"/>')
+    out.append(f'<rect x="{get_num(left)}" y="{get_num(top)}" '
+               f'width="{get_num(right-left)}" height="{get_num(bottom-top)}" '
+               f'fill="none" stroke="black" '
+               f'stroke-width="{get_num(get_px(LINE_WIDTH))}"/>')
+    return get_svg(width, height, font_size, out + texts)
+
+
+def get_y_ticks(y_max):
+    """Returns ticks from zero to 'y_max' with a step of 1, 2, 2.5 or 5 times
+    a power of ten."""
+    step = y_max / N_Y_TICKS
+    magnitude = 10 ** math.floor(math.log10(step))
+    step = next(a*magnitude for a in [1, 2, 2.5, 5, 10] 
+                    if a*magnitude >= step)
+    return [i*step for i in range(int(y_max/step) + 1)]
+
+
+def get_svg_wedge(cx, cy, radius, start, end, color):
+    if end - start >= 360:
+        return f'<circle cx="{get_num(cx)}" cy="{get_num(cy)}" ' \
+               f'r="{get_num(radius)}" fill="{color}"/>'
+    points = [(cx + radius*math.cos(math.radians(a)), 
+               cy - radius*math.sin(math.radians(a))) for a in (start, end)]
+    (x1, y1), (x2, y2) = [(get_num(x), get_num(y)) for x, y in points]
+    large_arc = int(end - start > 180)
+    return f'<path d="M{get_num(cx)} {get_num(cy)}L{x1} {y1}' \
+           f'A{get_num(radius)} {get_num(radius)} 0 {large_arc} 0 {x2} {y2}Z" ' \
+           f'fill="{color}"/>'
+
+
+def get_svg_text(x, y, text, anchor, baseline):
+    return f'<text x="{get_num(x)}" y="{get_num(y)}" text-anchor="{anchor}" ' \
+           f'dominant-baseline="{baseline}">{html.escape(str(text))}</text>'
+
+
+def get_svg(width, height, font_size, elements):
+    return f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" ' \
+           f'height="{height}" viewBox="0 0 {width} {height}" ' \
+           f'font-family="{FONT}" font-size="{get_num(font_size)}">\n' + \
+           '\n'.join(elements) + '\n</svg>\n'
+
+
+def get_axes_box(width, height):
+    """Returns left, top, right and bottom edge of axes in pixels."""
+    left, bottom, right, top = AXES_BOX
+    return left*width, (1-top)*height, right*width, (1-bottom)*height
+
+
+def get_px(points):
+    return points * SVG_DPI / 72
+
+
+def get_num(value):
+    """Formats number with at most one decimal."""
+    return f'{value:.1f}'.rstrip('0').rstrip('.')
+
+
+def write_svg(filename, img_dir, svg):
+    write_if_changed(f'{img_dir}/{filename}.svg', svg.encode())
+
+
+SVG_FUNCTIONS = {generate_release_dates_chart: svg_release_dates_chart,
+                 generate_origin_piechart: svg_origin_piechart,
+                 generate_stacked_barplot: svg_stacked_barplot}
+
+
 ###
 ##  UTIL
 #
@@ -285,15 +607,22 @@ def every_even(ticks):
     return [t for t in ticks if t%2==0]
 
 
-def getAlbumsPerYear(listOfYears):
-    out = []
-    for year in range(listOfYears[0], listOfYears[-1]+1):
-        out.append(listOfYears.count(year))
-    return out
+def write_if_changed(filename, contents):
+    if os.path.isfile(filename):
+        with open(filename, 'rb') as file:
+            if file.read() == contents:
+                return
+    with open(filename, 'wb') as file:
+        file.write(contents)
 
 
-def getYearRange(listOfYears):
-    return list(range(listOfYears[0], listOfYears[-1]+1))
+def read_cache(filename):
+    if not os.path.isfile(filename):
+        return {}
+    try:
+        return read_json_file(filename)
+    except ValueError:
+        return {}
 
 
 def read_json_file(filename):
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#
+# Usage: thumbnails.py [--jobs N]
+# Resizes covers from 'img/cover' to the height they are displayed at and to
+# double of it, and saves them as WebP and JPEG into 'img/thumb'. Thumbnails
+# are named by the hash of the cover, so unchanged covers never get
+# re-encoded, unless requested height or encoding options changed. Index of
+# thumbnails is saved in 'img/thumb/index.json'.
+#
+# To install Image library run:
+#   pip3 install pillow
+
+import argparse
+import concurrent.futures
+import hashlib
+import importlib
+import json
+import os
+import sys
+
+
+COVER_DIR = '../data/img/cover'
+THUMB_DIR = '../data/img/thumb'
+INDEX_FILE = 'index.json'
+HEIGHT = 123
+SCALES = [1, 2]
+HASH_LENGTH = 16
+
+# Extension: (Pillow format, save options)
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+           'jpg': ('JPEG', {'quality': 85, 'optimize': True,
+                            'progressive': True})}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates cover thumbnails.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        metavar='N', help='number of encoding processes')
+    args = parser.parse_args()
+    thumbnails(jobs=args.jobs)
+
+
+def thumbnails(cover_dir=COVER_DIR, thumb_dir=THUMB_DIR, height=HEIGHT,
+               jobs=1):
+    """Creates missing thumbnails, deletes the ones whose cover is gone and
+    returns the index, that maps cover's filename to a dict with its 'hash',
+    thumbnail 'heights' and hash of 'settings' they were encoded with. 
+    Returns empty index without creating thumbnails if Pillow is missing."""
+    try:
+        importlib.import_module('PIL.Image')
+    except ImportError:
+        print('Cannot create thumbnails, Pillow is not installed.', 
+              file=sys.stderr)
+        return {}
+    os.makedirs(thumb_dir, exist_ok=True)
+    index_path = f'{thumb_dir}/{INDEX_FILE}'
+    old_index = read_json_file(index_path) if os.path.isfile(index_path) \
+                    else {}
+    index = get_index(cover_dir, old_index)
+    heights = [height*a for a in SCALES]
+    settings = get_settings_hash(heights)
+    missing = [name for name, a in index.items()
+                   if a.get('settings') != settings or
+                       not thumbnails_exist(thumb_dir, a)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {name: executor.submit(encode_cover, f'{cover_dir}/{name}',
+                                         thumb_dir, index[name]['hash'],
+                                         heights)
+                       for name in missing}
+        for name, future in futures.items():
+            try:
+                index[name]['heights'] = future.result()
+                index[name]['settings'] = settings
+            # Pillow raises KeyError for formats it was built without.
+            except (OSError, KeyError) as e:
+                print(f'Cannot create thumbnail of {name}: {e}',
+                      file=sys.stderr)
+                del index[name]
+    remove_unused_thumbnails(thumb_dir, index)
+    write_json_file(index_path, index)
+    return index
+
+
+def get_index(cover_dir, old_index):
+    """Hashes covers whose size or modification time changed."""
+    out = {}
+    with os.scandir(cover_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            old = old_index.get(entry.name, {})
+            if old.get('size') == stat.st_size and \
+                    old.get('mtime') == stat.st_mtime_ns:
+                out[entry.name] = old
+                continue
+            out[entry.name] = {'size': stat.st_size,
+                               'mtime': stat.st_mtime_ns,
+                               'hash': get_file_hash(entry.path),
+                               'heights': []}
+    return out
+
+
+def thumbnails_exist(thumb_dir, entry):
+    if not entry['heights']:
+        return False
+    names = [get_thumbnail_name(entry['hash'], h, ext)
+                 for h in entry['heights'] for ext in FORMATS]
+    return all(os.path.isfile(f'{thumb_dir}/{a}') for a in names)
+
+
+def encode_cover(path, thumb_dir, a_hash, heights):
+    """Saves thumbnails of each height in all formats and returns their heights.
+    Covers are never upscaled, so heights can be lower than requested."""
+    from PIL import Image
+    with Image.open(path) as image:
+        image.load()
+    out = []
+    for height in heights:
+        height = min(height, image.height)
+        if height in out:
+            continue
+        width = max(1, round(image.width * height / image.height))
+        resized = image.resize((width, height), Image.LANCZOS)
+        for ext, (a_format, options) in FORMATS.items():
+            filename = f'{thumb_dir}/{get_thumbnail_name(a_hash, height, ext)}'
+            get_image_for_format(resized, a_format).save(filename, a_format,
+                                                         **options)
+        out.append(height)
+    return out
+
+
+def get_image_for_format(image, a_format):
+    """Converts image to a mode that can be saved in the format. Transparent
+    pixels are made white for JPEG."""
+    from PIL import Image
+    has_alpha = image.mode in ('RGBA', 'LA') or \
+                (image.mode == 'P' and 'transparency' in image.info)
+    if a_format == 'JPEG' and has_alpha:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    if has_alpha:
+        return image.convert('RGBA')
+    return image.convert('RGB')
+
+
+def remove_unused_thumbnails(thumb_dir, index):
+    used = {get_thumbnail_name(a['hash'], h, ext) for a in index.values()
+                for h in a['heights'] for ext in FORMATS}
+    for name in os.listdir(thumb_dir):
+        if name != INDEX_FILE and name not in used:
+            os.remove(f'{thumb_dir}/{name}')
+
+
+def get_settings_hash(heights):
+    """Hash of requested heights and encoding options. Heights of thumbnails
+    can be lower than requested, so the requested ones are hashed."""
+    text = json.dumps({'heights': heights, 'formats': FORMATS}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:HASH_LENGTH]
+
+
+def get_thumbnail_name(a_hash, height, ext):
+    return f'{a_hash}_{height}.{ext}'
+
+
+###
+##  UTIL
+#
+
+def get_file_hash(filename):
+    with open(filename, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()[:HASH_LENGTH]
+
+
+def read_json_file(filename):
+    with open(filename, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def write_json_file(filename, an_object):
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump(an_object, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()